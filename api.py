@@ -1,11 +1,8 @@
 from __future__ import annotations
 from enum import Enum
-from collections import deque
-from itertools import repeat
-from tkinter import Variable
-from typing import Any, Callable, Generic, List, Literal, LiteralString, Set, TypeVar, Union, overload
-
-import pyperclip
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Dict, Generic, List, Literal, LiteralString, Set, TextIO, Tuple, TypeVar, Union, overload
 
 
 PLC_NAME = "Rockwell EtherNet/IP (CompactLogix)"
@@ -22,17 +19,21 @@ DT = TypeVar('DT')
 dt = Literal['bool', 'unsigned char', 'char', 'unsigned short', 
              'short', 'unsigned int', 'int', 'unsigned long', 'long', 'float', 'double']
 
+NO_RESOURCES:Tuple[Resource, ...] = ()
+
 class Resource:
+    __slots__ = ('resources',)
     def __init__(self, *resources:Resource):
-        self.resources:List[Resource] = list(resources)
+        self.resources:Tuple[Resource, ...] = resources or NO_RESOURCES
     def process(self, macro:Macro) -> None:
         for r in self.resources:
             if isinstance(r, Resource) and not r.__class__ is Resource:
                 r.process(macro)
     
 class STATEMENT(Resource):
+    __slots__ = ()
     def __init__(self, *resources:Resource):
-        super().__init__(resources)
+        super().__init__(*resources)
         
     def __str__(self) -> str: ...
 
@@ -42,14 +43,39 @@ class STATEMENT(Resource):
     def bake(self, macro:Macro):
         macro.write_raw(str(self))
         
-class EMPTY(STATEMENT):
+    def compile(self, macro:Macro):
+        self.process(macro)
+        self.bake(macro)
+        
+    def blocks(self) -> List[List[STATEMENT]]:
+        return []
+    
+    def split(self) -> List[STATEMENT]:
+        return [self]
+        
+class STATELESS(STATEMENT):
+    __slots__ = ()
+    _instances:Dict[type, STATELESS] = {}
+    
+    def __new__(cls):
+        instance = STATELESS._instances.get(cls)
+        if instance is None:
+            instance = super().__new__(cls)
+            STATEMENT.__init__(instance)
+            STATELESS._instances[cls] = instance
+        return instance
+    
     def __init__(self):
-        super().__init__()
+        pass
         
+class EMPTY(STATELESS):
+    __slots__ = ()
+    
     def __str__(self) -> str:
         return '\n'
 
 class BASE_STATEMENT(STATEMENT):
+    __slots__ = ('_res',)
     def __init__(self, value:str=None):
         super().__init__()
         self._res = value
@@ -60,6 +86,7 @@ class BASE_STATEMENT(STATEMENT):
         return self._res + '\n'
 
 class COMMENT(STATEMENT):
+    __slots__ = ('text',)
     def __init__(self, text:str):
         super().__init__()
         self.text = text
@@ -68,6 +95,7 @@ class COMMENT(STATEMENT):
         return ''.join([f'// {l}\n' for l in self.text.splitlines(False)])
 
 class C_IF(STATEMENT):
+    __slots__ = ('condition',)
     def __init__(self, condition:Union[EXPRESSION, Variable[bool]]):
         super().__init__()
         if isinstance(condition, Variable):
@@ -86,11 +114,34 @@ class C_IF(STATEMENT):
         macro._open_if()
 
 class CONDITION_BLOCK(STATEMENT):
+    __slots__ = ('content',)
     def __init__(self, *content:STATEMENT):
         super().__init__()
         self.content:List[STATEMENT] = list([*content])
+        
+    def _finish(self, macro:Macro):
+        pass
+        
+    def process(self, macro: Macro):
+        for s in self.content:
+            s.process(macro)
+        super().process(macro)
+        
+    def bake(self, macro: Macro):
+        for s in self.content:
+            s.bake(macro)
+        self._finish(macro)
+        
+    def compile(self, macro: Macro):
+        for s in self.content:
+            s.compile(macro)
+        self._finish(macro)
+        
+    def blocks(self) -> List[List[STATEMENT]]:
+        return [self.content]
 
 class COMPLETED_CONTAINER(STATEMENT):
+    __slots__ = ('_parent',)
     def __init__(self, parent:CONDITION_BLOCK):
         super().__init__()
         self._parent = parent
@@ -100,8 +151,15 @@ class COMPLETED_CONTAINER(STATEMENT):
 
     def bake(self, macro: Macro):
         self._parent.bake(macro)
+        
+    def compile(self, macro: Macro):
+        self._parent.compile(macro)
+        
+    def blocks(self) -> List[List[STATEMENT]]:
+        return self._parent.blocks()
 
 class ELSE_CONTAINER(CONDITION_BLOCK):
+    __slots__ = ('_empty',)
     def __init__(self, parent:CONDITION_BLOCK):
         super().__init__(*parent.content)
         self._empty = True
@@ -113,18 +171,12 @@ class ELSE_CONTAINER(CONDITION_BLOCK):
         self.content.append(C_END_IF())
         return COMPLETED_CONTAINER(self)
         
-    def process(self, macro: Macro):
-        for s in self.content:
-            s.process(macro)
-        super().process(macro)
-        
-    def bake(self, macro: Macro):
-        for s in self.content:
-            s.bake(macro)
+    def _finish(self, macro: Macro):
         if self._empty:
             C_END_IF().bake(macro)
 
 class ELIF_CONTAINER(CONDITION_BLOCK):
+    __slots__ = ('_parent', '_empty')
     def __init__(self, parent:CONDITION_BLOCK):
         super().__init__(*parent.content)
         self._parent = parent
@@ -135,19 +187,13 @@ class ELIF_CONTAINER(CONDITION_BLOCK):
         self.content.extend(body)
         return IF_CONTAINER(self)
     
-    def process(self, macro: Macro):
-        for s in self.content:
-            s.process(macro)
-        super().process(macro)
-        
-    def bake(self, macro: Macro):
-        for s in self.content:
-            s.bake(macro)
+    def _finish(self, macro: Macro):
         if self._empty:
             C_END_IF().bake(macro)
 
 
 class IF_CONTAINER(CONDITION_BLOCK):
+    __slots__ = ('_parent', '_ends')
     def __init__(self, parent:CONDITION_BLOCK):
         super().__init__(*parent.content)
         self._parent = parent
@@ -161,18 +207,12 @@ class IF_CONTAINER(CONDITION_BLOCK):
         self.content.append(C_ELIF(condition))
         return ELIF_CONTAINER(self)
     
-    def process(self, macro: Macro):
-        for s in self.content:
-            s.process(macro)
-        super().process(macro)
-        
-    def bake(self, macro: Macro):
-        for s in self.content:
-            s.bake(macro)
+    def _finish(self, macro: Macro):
         if self._ends:
             C_END_IF().bake(macro)
 
 class IF(CONDITION_BLOCK):
+    __slots__ = ('_empty',)
     def __init__(self, condition:EXPRESSION):
         super().__init__(C_IF(condition))
         self._empty = True
@@ -182,21 +222,13 @@ class IF(CONDITION_BLOCK):
         self.content.extend(body)
         return IF_CONTAINER(self)
     
-    def process(self, macro: Macro):
-        for s in self.content:
-            s.process(macro)
-        super().process(macro)
-        
-    def bake(self, macro: Macro):
-        for s in self.content:
-            s.bake(macro)
+    def _finish(self, macro: Macro):
         if self._empty:
             C_END_IF().bake(macro)
         
     
-class C_ELSE(STATEMENT):
-    def __init__(self):
-        super().__init__()
+class C_ELSE(STATELESS):
+    __slots__ = ()
     
     def __str__(self) -> str:
         return 'else\n'
@@ -207,6 +239,7 @@ class C_ELSE(STATEMENT):
         macro._open_if()
 
 class C_ELIF(STATEMENT):
+    __slots__ = ('condition',)
     def __init__(self, condition:Union[EXPRESSION, Variable[bool]]):
         super().__init__()
         if isinstance(condition, Variable):
@@ -226,9 +259,8 @@ class C_ELIF(STATEMENT):
         macro._open_if()
 
 
-class C_END_IF(STATEMENT):
-    def __init__(self):
-        super().__init__()
+class C_END_IF(STATELESS):
+    __slots__ = ()
     
     def __str__(self) -> str:
         return 'end if\n'
@@ -238,23 +270,46 @@ class C_END_IF(STATEMENT):
         super().bake(macro)
 
 class BLOCK(STATEMENT):
+    __slots__ = ('statements',)
     def __init__(self, *statements:STATEMENT):
-        super().__init__(*statements)
-        self.statements = statements
+        super().__init__()
+        self.statements:List[STATEMENT] = list(statements)
+        
+    def write(self, *statements:STATEMENT):
+        self.statements.extend(statements)
+        
+    def process(self, macro):
+        for s in self.statements:
+            s.process(macro)
     
     def bake(self, macro):
         for s in self.statements:
             s.bake(macro)
+            
+    def compile(self, macro):
+        for s in self.statements:
+            s.compile(macro)
+            
+    def blocks(self) -> List[List[STATEMENT]]:
+        return [self.statements]
+    
+    def split(self) -> List[STATEMENT]:
+        return list(self.statements)
 
 class VARIABLE_BLOCK(STATEMENT):
+    __slots__ = ()
     def __init__(self):
         super().__init__()
         
     def bake(self, macro: Macro):
         for v in macro.variables:
             macro.write_raw(v.declare(), '\n')
+            
+    def compile(self, macro: Macro):
+        macro._declare_here()
 
 class BEGIN_MACRO(STATEMENT):
+    __slots__ = ()
     def __init__(self):
         super().__init__()
     
@@ -266,6 +321,7 @@ class BEGIN_MACRO(STATEMENT):
         macro._open_macro()
 
 class END_MACRO(STATEMENT):
+    __slots__ = ()
     def __init__(self):
         super().__init__()
     
@@ -277,6 +333,7 @@ class END_MACRO(STATEMENT):
         super().bake(macro)
 
 class ASSIGNEMENT(STATEMENT):
+    __slots__ = ('var', 'value')
     def __init__(self, var:Variable[DT], value:Any):
         super().__init__()
         self.var = var
@@ -299,16 +356,15 @@ def string_literal(v:str) -> str:
     return v
 
 class CALL(STATEMENT):
+    __slots__ = ('funcName', 'params')
     def __init__(self, funcName: str, *params:Union[Variable, bool, int, float, str]):
         super().__init__()
         self.funcName = funcName
-        self.params:List[Union[Variable, bool, int, float, str]] = list([*params])
+        self.params:Tuple[Union[Variable, bool, int, float, str], ...] = params
     
     def __str__(self) -> str:
-        for i, p in enumerate(self.params):
-            if isinstance(p, str):
-                self.params[i] = string_literal(p)
-        return f'{self.funcName}({", ".join([str(p) for p in self.params])})\n'
+        params = [string_literal(p) if isinstance(p, str) else str(p) for p in self.params]
+        return f'{self.funcName}({", ".join(params)})\n'
     
     def process(self, macro: Macro):
         for p in self.params:
@@ -317,6 +373,7 @@ class CALL(STATEMENT):
         super().process(macro)
 
 class RETURN(STATEMENT):
+    __slots__ = ('ret',)
     def __init__(self, ret:Union[EXPRESSION, Variable, bool, int, float, str, None] = None):
         super().__init__()
         self.ret = ret
@@ -331,21 +388,20 @@ class RETURN(STATEMENT):
             self.ret.process(macro)
         super().process(macro)
 
-class BREAK(STATEMENT):
-    def __init__(self):
-        super().__init__()
-        
+class BREAK(STATELESS):
+    __slots__ = ()
+    
     def __str__(self) -> str:
         return 'break'
 
-class CONTINUE(STATEMENT):
-    def __init__(self):
-        super().__init__()
-        
+class CONTINUE(STATELESS):
+    __slots__ = ()
+    
     def __str__(self) -> str:
         return 'continue'
     
 class EXPRESSION(Resource):
+    __slots__ = ()
     def __init__(self, *exps:EXPRESSION):
         super().__init__(*exps)
     
@@ -362,53 +418,23 @@ class EXPRESSION(Resource):
     def __invert__(self) -> EXPRESSION:
         return NOT(self)
     
-    @overload
-    def __eq__(self, o:Union[int, float, bool, str]) -> LITERAL:
-        return LITERAL(f'{self.name} == {o}')
-    
-    def __eq__(self, o:Union[Variable, EXPRESSION]) -> LITERAL:
-        self.resources.append(o)
-        return LITERAL(f'{self.name} == {str(o)}')
-    
-    @overload
-    def __ne__(self, o:Union[int, float, bool, str]) -> LITERAL:
-        return LITERAL(f'{self.name} <> {o}')
+    def __eq__(self, o:Union[Variable, EXPRESSION, int, float, bool, str]) -> COMPARE:
+        return COMPARE(self, '==', o)
     
-    def __ne__(self, o:Union[Variable, EXPRESSION]) -> LITERAL:
-        self.resources.append(o)
-        return LITERAL(f'{self.name} <> {str(o)}')
+    def __ne__(self, o:Union[Variable, EXPRESSION, int, float, bool, str]) -> COMPARE:
+        return COMPARE(self, '<>', o)
     
-    @overload
-    def __lt__(self, o:Union[int, float, bool, str]) -> LITERAL:
-        return LITERAL(f'{self.name} < {o}')
-    
-    def __lt__(self, o:Union[Variable, EXPRESSION]) -> LITERAL:
-        self.resources.append(o)
-        return LITERAL(f'{self.name} < {str(o)}')
+    def __lt__(self, o:Union[Variable, EXPRESSION, int, float, bool, str]) -> COMPARE:
+        return COMPARE(self, '<', o)
 
-    @overload
-    def __le__(self, o:Union[int, float, bool, str]) -> LITERAL:
-        return LITERAL(f'{self.name} <= {o}')
-    
-    def __le__(self, o:Union[Variable, EXPRESSION]) -> LITERAL:
-        self.resources.append(o)
-        return LITERAL(f'{self.name} <= {str(o)}')
-    
-    @overload
-    def __gt__(self, o:Union[int, float, bool, str]) -> LITERAL:
-        return LITERAL(f'{self.name} > {o}')
+    def __le__(self, o:Union[Variable, EXPRESSION, int, float, bool, str]) -> COMPARE:
+        return COMPARE(self, '<=', o)
     
-    def __gt__(self, o:Union[Variable, EXPRESSION]) -> LITERAL:
-        self.resources.append(o)
-        return LITERAL(f'{self.name} > {str(o)}')
+    def __gt__(self, o:Union[Variable, EXPRESSION, int, float, bool, str]) -> COMPARE:
+        return COMPARE(self, '>', o)
     
-    @overload
-    def __ge__(self, o:Union[int, float, bool, str]) -> LITERAL:
-        return LITERAL(f'{self.name} >= {o}')
-    
-    def __ge__(self, o:Union[Variable, EXPRESSION]) -> LITERAL:
-        self.resources.append(o)
-        return LITERAL(f'{self.name} >= {str(o)}')
+    def __ge__(self, o:Union[Variable, EXPRESSION, int, float, bool, str]) -> COMPARE:
+        return COMPARE(self, '>=', o)
     
     def __and__(self, o:Union[EXPRESSION, Variable[bool]]) -> AND:
         return AND(self, o)
@@ -420,38 +446,23 @@ class EXPRESSION(Resource):
         return NOT(self)
     
     def __sub__(self, o) -> LITERAL:
-        res = LITERAL(f'{str(self)} - {str(o)}')
-        res.resources.append(self)
-        if isinstance(o, Resource):
-            res.resources.append(o)
-        return res
+        return LITERAL(f'{str(self)} - {str(o)}', self, o)
     
     def __add__(self, o) -> LITERAL:
-        res = LITERAL(f'{str(self)} + {str(o)}')
-        res.resources.append(self)
-        if isinstance(o, Resource):
-            res.resources.append(o)
-        return res
+        return LITERAL(f'{str(self)} + {str(o)}', self, o)
     
     def __mul__(self, o) -> LITERAL:
-        res = LITERAL(f'{str(self)} * {str(o)}')
-        res.resources.append(self)
-        if isinstance(o, Resource):
-            res.resources.append(o)
-        return res
+        return LITERAL(f'{str(self)} * {str(o)}', self, o)
     
     def __truediv__(self, o) -> LITERAL:
-        res = LITERAL(f'{str(self)} / {str(o)}')
-        res.resources.append(self)
-        if isinstance(o, Resource):
-            res.resources.append(o)
-        return res
+        return LITERAL(f'{str(self)} / {str(o)}', self, o)
     
     def __str__(self) -> str: ...
     
 class LITERAL(EXPRESSION):
-    def __init__(self, literal:str):
-        super().__init__()
+    __slots__ = ('literal',)
+    def __init__(self, literal:str, *resources:Union[Resource, Any]):
+        super().__init__(*[r for r in resources if isinstance(r, Resource)])
         self.literal = literal
         
     def __str__(self) -> str:
@@ -460,7 +471,23 @@ class LITERAL(EXPRESSION):
     def __repr__(self):
         return f"[{self.literal}]"
     
+class COMPARE(EXPRESSION):
+    __slots__ = ('left', 'operator', 'right')
+    def __init__(self, left:Union[EXPRESSION, Variable, int, float, bool, str], operator:str, 
+                 right:Union[EXPRESSION, Variable, int, float, bool, str]):
+        super().__init__(*[o for o in (left, right) if isinstance(o, Resource)])
+        self.left = left
+        self.operator = operator
+        self.right = right
+        
+    def __str__(self) -> str:
+        return f'{str(self.left)} {self.operator} {str(self.right)}'
+    
+    def __repr__(self):
+        return f'[{repr(self.left)} {self.operator} {repr(self.right)}]'
+    
 class NOT(EXPRESSION):
+    __slots__ = ('expression',)
     def __init__(self, expression:EXPRESSION):
         super().__init__(expression)
         self.expression = expression.as_literal() if isinstance(expression, Variable) else expression
@@ -475,6 +502,7 @@ class NOT(EXPRESSION):
         return f'NOT [{repr(self.expression)}]'
     
 class OR(EXPRESSION):
+    __slots__ = ('_expressions',)
     def __init__(self, *expressions:EXPRESSION):
         super().__init__(*expressions)
         self._expressions:List[EXPRESSION] = [*[(e.as_literal() if isinstance(e, Variable) else e) for e in expressions]]
@@ -488,7 +516,7 @@ class OR(EXPRESSION):
     
     def append(self, *expressions:EXPRESSION):
         self._expressions.extend(expressions)
-        self.resources.extend(expressions)
+        self.resources = (*self.resources, *expressions)
         
     def __str__(self):
         return f'({" or ".join([str(e) for e in self._expressions])})'
@@ -497,6 +525,7 @@ class OR(EXPRESSION):
         return f'[{" OR ".join([repr(e) for e in self._expressions])}]'
         
 class AND(EXPRESSION):
+    __slots__ = ('_expressions',)
     def __init__(self, *expressions:Union[EXPRESSION, Variable[bool]]):
         super().__init__(*expressions)
         self._expressions:List[EXPRESSION] = [*[(e.as_literal() if isinstance(e, Variable) else e) for e in expressions]]
@@ -510,7 +539,7 @@ class AND(EXPRESSION):
         
     def append(self, *expressions:EXPRESSION):
         self._expressions.extend(expressions)
-        self.resources.extend(expressions)
+        self.resources = (*self.resources, *expressions)
         
     def __str__(self):
         return f'({" and ".join([str(e) for e in self._expressions])})'
@@ -519,6 +548,7 @@ class AND(EXPRESSION):
         return f'[{" AND ".join([repr(e) for e in self._expressions])}]'
 
 class Variable(Resource, Generic[DT]):
+    __slots__ = ('name', 'dtype', 'default')
     def __init__(self, name:str, dtype:dt, default:DT=None):
         Resource.__init__(self)
         self.name = name
@@ -530,62 +560,30 @@ class Variable(Resource, Generic[DT]):
         macro.add_variable(self)
         
     def as_literal(self) -> LITERAL:
-        res = LITERAL(str(self))
-        res.resources.append(self)
-        return res
+        return LITERAL(str(self), self)
         
     def declare(self) -> str:
         if self.default is None:
             return f'{self.dtype} {self.name}'
         return f'{self.dtype} {self.name} = {self.default}'
     
-    @overload
-    def __eq__(self, o:Union[int, float, bool, str]) -> LITERAL:
-        return LITERAL(f'{self.name} == {o}')
-    
-    def __eq__(self, o:Union[Variable, EXPRESSION]) -> LITERAL:
-        self.resources.append(o)
-        return LITERAL(f'{self.name} == {str(o)}')
+    def __eq__(self, o:Union[Variable, EXPRESSION, int, float, bool, str]) -> COMPARE:
+        return COMPARE(self, '==', o)
     
-    @overload
-    def __ne__(self, o:Union[int, float, bool, str]) -> LITERAL:
-        return LITERAL(f'{self.name} <> {o}')
+    def __ne__(self, o:Union[Variable, EXPRESSION, int, float, bool, str]) -> COMPARE:
+        return COMPARE(self, '<>', o)
     
-    def __ne__(self, o:Union[Variable, EXPRESSION]) -> LITERAL:
-        self.resources.append(o)
-        return LITERAL(f'{self.name} <> {str(o)}')
-    
-    @overload
-    def __lt__(self, o:Union[int, float, bool, str]) -> LITERAL:
-        return LITERAL(f'{self.name} < {o}')
-    
-    def __lt__(self, o:Union[Variable, EXPRESSION]) -> LITERAL:
-        self.resources.append(o)
-        return LITERAL(f'{self.name} < {str(o)}')
+    def __lt__(self, o:Union[Variable, EXPRESSION, int, float, bool, str]) -> COMPARE:
+        return COMPARE(self, '<', o)
 
-    @overload
-    def __le__(self, o:Union[int, float, bool, str]) -> LITERAL:
-        return LITERAL(f'{self.name} <= {o}')
-    
-    def __le__(self, o:Union[Variable, EXPRESSION]) -> LITERAL:
-        self.resources.append(o)
-        return LITERAL(f'{self.name} <= {str(o)}')
-    
-    @overload
-    def __gt__(self, o:Union[int, float, bool, str]) -> LITERAL:
-        return LITERAL(f'{self.name} > {o}')
-    
-    def __gt__(self, o:Union[Variable, EXPRESSION]) -> LITERAL:
-        self.resources.append(o)
-        return LITERAL(f'{self.name} > {str(o)}')
+    def __le__(self, o:Union[Variable, EXPRESSION, int, float, bool, str]) -> COMPARE:
+        return COMPARE(self, '<=', o)
     
-    @overload
-    def __ge__(self, o:Union[int, float, bool, str]) -> LITERAL:
-        return LITERAL(f'{self.name} >= {o}')
+    def __gt__(self, o:Union[Variable, EXPRESSION, int, float, bool, str]) -> COMPARE:
+        return COMPARE(self, '>', o)
     
-    def __ge__(self, o:Union[Variable, EXPRESSION]) -> LITERAL:
-        self.resources.append(o)
-        return LITERAL(f'{self.name} >= {str(o)}')
+    def __ge__(self, o:Union[Variable, EXPRESSION, int, float, bool, str]) -> COMPARE:
+        return COMPARE(self, '>=', o)
     
     def __and__(self, o:Union[EXPRESSION, Variable[bool]]) -> AND:
         return AND(self, o)
@@ -597,32 +595,16 @@ class Variable(Resource, Generic[DT]):
         return NOT(self)
     
     def __sub__(self, o) -> LITERAL:
-        res = LITERAL(f'{str(self)} - {str(o)}')
-        res.resources.append(self)
-        if isinstance(o, Resource):
-            res.resources.append(o)
-        return res
+        return LITERAL(f'{str(self)} - {str(o)}', self, o)
     
     def __add__(self, o) -> LITERAL:
-        res = LITERAL(f'{str(self)} + {str(o)}')
-        res.resources.append(self)
-        if isinstance(o, Resource):
-            res.resources.append(o)
-        return res
+        return LITERAL(f'{str(self)} + {str(o)}', self, o)
     
     def __mul__(self, o) -> LITERAL:
-        res = LITERAL(f'{str(self)} * {str(o)}')
-        res.resources.append(self)
-        if isinstance(o, Resource):
-            res.resources.append(o)
-        return res
+        return LITERAL(f'{str(self)} * {str(o)}', self, o)
     
     def __truediv__(self, o) -> LITERAL:
-        res = LITERAL(f'{str(self)} / {str(o)}')
-        res.resources.append(self)
-        if isinstance(o, Resource):
-            res.resources.append(o)
-        return res
+        return LITERAL(f'{str(self)} / {str(o)}', self, o)
 
     def set(self, o:Union[Variable, EXPRESSION, bool, int, float, str]) -> ASSIGNEMENT:
         return ASSIGNEMENT(self, o)
@@ -634,6 +616,19 @@ class Variable(Resource, Generic[DT]):
         return self.name
 
 
+class Array(Variable[DT]):
+    __slots__ = ('size',)
+    def __init__(self, name:str, dtype:dt, size:int):
+        super().__init__(name, dtype)
+        self.size = size
+        
+    def declare(self) -> str:
+        return f'{self.dtype} {self.name}[{self.size}]'
+    
+    def __getitem__(self, index:int) -> LITERAL:
+        return LITERAL(f'{self.name}[{index}]', self)
+    
+
 def vuchar(name:str, default:int = None) -> Variable[int]: return Variable(name, 'unsigned char', default)
 def vchar(name:str, default:int = None) -> Variable[int]: return Variable(name, 'char', default)
 def vushort(name:str, default:int = None) -> Variable[int]: return Variable(name, 'unsigned short', default)
@@ -652,6 +647,61 @@ class BlockType(Enum):
     FOR_BLOCK = 2
     MACRO_BLOCK = 3
 
+def count_nodes(statements:List[STATEMENT]) -> Counter:
+    """Counts the statements of a tree by class name."""
+    counts:Counter = Counter()
+    stack = list(statements)
+    while stack:
+        s = stack.pop()
+        counts[type(s).__name__] += 1
+        for b in s.blocks():
+            stack.extend(b)
+    return counts
+
+class MacroStats:
+    """What one compile() of a macro did, filled in when the macro is instrumented.
+
+    phases holds the wall time in seconds of process (collecting the
+    variables), bake (writing the lines, write_raw included) and join, plus
+    build when whoever built the macro timed it. profile is a pstats.Stats of
+    the compile when it was asked for.
+    """
+    def __init__(self, name:str, profiling:bool = False):
+        self.name = name
+        self.profiling = profiling
+        self.phases:Dict[str, float] = {}
+        self.nodes:Counter = Counter()
+        self.write_raw_calls = 0
+        self.write_raw_time = 0.0
+        self.bytes_emitted = 0
+        self.profile = None
+        
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'phases': {k: round(v, 6) for k, v in self.phases.items()},
+            'nodes': dict(self.nodes.most_common()),
+            'write_raw_calls': self.write_raw_calls,
+            'write_raw_time': round(self.write_raw_time, 6),
+            'bytes_emitted': self.bytes_emitted,
+        }
+        
+    def __str__(self) -> str:
+        lines = [self.name]
+        for k, v in self.phases.items():
+            lines.append(f'    {k:<12}{v * 1000:10.2f} ms')
+        lines.append(f'    {"write_raw":<12}{self.write_raw_time * 1000:10.2f} ms  '
+                     f'{self.write_raw_calls} calls, {self.bytes_emitted} bytes')
+        top = ', '.join(f'{k} {v}' for k, v in self.nodes.most_common(6))
+        lines.append(f'    {"nodes":<12}{sum(self.nodes.values()):10}     {top}')
+        if self.profile is not None:
+            import io
+            buf = io.StringIO()
+            self.profile.stream = buf
+            self.profile.sort_stats('cumulative').print_stats(15)
+            lines.append(buf.getvalue().rstrip())
+        return '\n'.join(lines)
+
 class Macro:
     def __init__(self, name:str, description:str):
         self.name = name
@@ -660,24 +710,82 @@ class Macro:
         self._maxlen = 200
         self.statements:List[STATEMENT] = []
         self.result:List[str] = ['']
-        self.variables:Set[Variable] = set()
+        self._lines:List[str] = []
+        self._indents:List[str] = ['']
+        self._declarations:List[Tuple[int, str]] = []
+        self._compiled:str = None
+        self._names:Set[str] = None
+        self._stream:TextIO = None
+        self.stats:MacroStats = None
+        # Insertion ordered, the declarations come out in the same order on every run
+        self.variables:Dict[Variable, None] = {}
         self._nest:deque[BlockType] = deque()
         self._variable_block = VARIABLE_BLOCK()
     
     def add_variable(self, var:Variable[DT]) -> Variable[DT]:
-        self.variables.add(var)
+        self.variables.setdefault(var)
+        return var
+    
+    def temporary(self, prefix:str, dtype:dt, size:int = None) -> Variable:
+        if self._names is None:
+            scratch = Macro(self.name, self.description)
+            for s in self.statements:
+                s.process(scratch)
+            self._names = {v.name for v in scratch.variables | self.variables}
+        i = 0
+        while f'{prefix}{i}' in self._names:
+            i += 1
+        name = f'{prefix}{i}'
+        self._names.add(name)
+        var = Variable(name, dtype) if size is None else Array(name, dtype, size)
+        return self.add_variable(var)
+    
+    def _indent(self) -> str:
+        while len(self._indents) <= self.indentation:
+            self._indents.append(self._indents[-1] + '    ')
+        return self._indents[self.indentation]
     
     def write_raw(self, *values:str):
         v = ''.join([str(vv) for vv in values])
-        for l in v.splitlines():
-            l = ''.join(repeat('    ', self.indentation)) + l + '\n'
-            if (len(l) + len(self.result[-1])) > self._maxlen:
-                self.result.append(l)
-            else:
-                self.result[-1] += l
+        indent = self._indent()
+        lines = [indent + l + '\n' for l in v.splitlines()]
+        if self._stream is not None:
+            self._stream.writelines(lines)
+        else:
+            self._lines.extend(lines)
+        
+    def _counted_write_raw(self, *values:str):
+        n = len(self._lines)
+        start = time.perf_counter()
+        Macro.write_raw(self, *values)
+        self.stats.write_raw_time += time.perf_counter() - start
+        self.stats.write_raw_calls += 1
+        self.stats.bytes_emitted += sum(len(l) for l in self._lines[n:])
+        
+    def _split(self) -> List[str]:
+        chunks:List[str] = []
+        chunk:List[str] = []
+        size = 0
+        for l in self._lines:
+            if (len(l) + size) > self._maxlen:
+                chunks.append(''.join(chunk))
+                chunk = []
+                size = 0
+            chunk.append(l)
+            size += len(l)
+        chunks.append(''.join(chunk))
+        return chunks
     
     def write(self, *statements:STATEMENT):
+        self.invalidate()
         self.statements.extend(statements)
+        
+    def invalidate(self):
+        self._compiled = None
+        self._names = None
+        
+    def _declare_here(self):
+        self._declarations.append((len(self._lines), self._indent()))
                 
     def _open_if(self):
         self._nest.append(BlockType.IF_BLOCK)
@@ -741,28 +849,232 @@ class Macro:
     def end(self):
         self.write(END_MACRO())
     
-    def display(self):
-        self.result = ['']
-        for s in self.statements:
-            s.process(self)
+    def instrument(self, profile:bool = False) -> MacroStats:
+        """Records every following compile() in a new MacroStats, under cProfile with profile.
         
-        for s in self.statements:
-            s.bake(self)
+        Without it compile() runs no instrumentation code at all.
+        """
+        self.invalidate()
+        self.stats = MacroStats(self.name, profile)
+        return self.stats
+    
+    def _compile_instrumented(self) -> str:
+        stats = self.stats
+        stats.nodes = count_nodes(self.statements)
+        stats.write_raw_calls = stats.bytes_emitted = 0
+        stats.write_raw_time = 0.0
+        profiler = None
+        if stats.profiling:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        # The instance attribute shadows write_raw for this compile only
+        self.write_raw = self._counted_write_raw
+        try:
+            start = time.perf_counter()
+            for s in self.statements:
+                s.process(self)
+            stats.phases['process'] = time.perf_counter() - start
+            
+            # The variables are known, so bake writes the declarations itself
+            self._lines = []
+            start = time.perf_counter()
+            for s in self.statements:
+                s.bake(self)
+            stats.phases['bake'] = time.perf_counter() - start
+            
+            start = time.perf_counter()
+            self.result = self._split()
+            self._compiled = ''.join(self.result)
+            stats.phases['join'] = time.perf_counter() - start
+        finally:
+            del self.write_raw
+            self._nest.clear()
+            self.indentation = 0
+            if profiler is not None:
+                profiler.disable()
+                import pstats
+                stats.profile = pstats.Stats(profiler)
+        return self._compiled
+    
+    def compile(self) -> str:
+        if self._compiled is not None:
+            return self._compiled
+        if self.stats is not None:
+            return self._compile_instrumented()
+        self._lines = []
+        self._declarations = []
+        try:
+            for s in self.statements:
+                s.compile(self)
+        finally:
+            # A statement that raised leaves its blocks open
+            self._nest.clear()
+            self.indentation = 0
         
+        # Variables are only known once the whole tree was walked
+        for at, indent in reversed(self._declarations):
+            self._lines[at:at] = [indent + v.declare() + '\n' for v in self.variables]
+        self.result = self._split()
+        self._compiled = ''.join(self.result)
+        return self._compiled
+    
+    def bake_to(self, stream:TextIO):
+        """Writes the same text as compile() to stream while the statements are baked.
+
+        The declarations come first, so a pre-pass collects the variables, then
+        every line goes to the stream as soon as it is written and only the
+        statements being baked, one per nesting level, are held. Write to a
+        socket through socket.makefile('w').
+        """
+        for s in self.statements:
+            s.process(self)
+        self._stream = stream
+        try:
+            for s in self.statements:
+                s.bake(self)
+        finally:
+            self._stream = None
+            self._nest.clear()
+            self.indentation = 0
+    
+    def display(self):
+        self.compile()
         for l in self.result:
             print(l, end='')
             
     def clipboard(self):
-        self.result = ['']
-        for s in self.statements:
-            s.process(self)
+        # Only needed when copying, and needs a clipboard backend
+        import pyperclip
+        pyperclip.copy(self.compile())
         
-        for s in self.statements:
-            s.bake(self)
-        pyperclip.copy(''.join(self.result))
+    def save(self, path:str):
+        with open(path, 'w') as wr:
+            if self._compiled is None and self.stats is None:
+                self.bake_to(wr)
+            else:
+                wr.write(self.compile())
+    
+    def _body(self) -> List[STATEMENT]:
+        begin = next((i for i, s in enumerate(self.statements) if isinstance(s, BEGIN_MACRO)), None)
+        end = next((i for i, s in enumerate(self.statements) if isinstance(s, END_MACRO)), None)
+        if begin is None or end is None:
+            raise SyntaxError(f'{self.name} has no begin() and end().')
+        return [s for s in self.statements[begin + 1:end] if s is not self._variable_block]
+    
+    def _units(self, statements:List[STATEMENT]) -> List[List[STATEMENT]]:
+        # Flat if/end if markers keep everything between them in the same unit
+        units:List[List[STATEMENT]] = []
+        depth = 0
+        for s in statements:
+            if depth == 0:
+                units.append([])
+            units[-1].append(s)
+            if isinstance(s, C_IF):
+                depth += 1
+            elif isinstance(s, C_END_IF):
+                depth -= 1
+        return units
+    
+    def partition(self, budget:float, prologue:List[STATEMENT] = (), 
+                  cost:Callable[[STATEMENT], float] = None) -> List[Macro]:
+        """Splits the macro into parts that each stay under the budget.
+        
+        The statements between begin() and end() are cut between top-level
+        statements (never inside an if/end if) and packed in order into parts
+        named <name>0, <name>1, ... Each part ends by triggering the next one
+        with ASYNC_TRIG_MACRO. A statement that does not fit alone is split with
+        STATEMENT.split when possible, otherwise it gets a part of its own.
+        
+        cost gives the weight of a statement, the length of its generated text
+        by default, and is called once per statement. Local variables do not
+        survive from one part to the next: the prologue statements, run at the
+        start of every part, must set what the parts need (they are left out
+        of the statements to split). Passes that follow values across
+        statements should run on each part.
+        """
+        # The text of a statement is at least as long as the text of its pieces
+        additive = cost is None or cost is statement_size
+        cost = cost or statement_size
+        # Every statement is costed and split at most once
+        sizes:Dict[int, float] = {}
+        bounds:Dict[int, float] = {}
+        splits:Dict[int, Tuple[STATEMENT, List[STATEMENT]]] = {}
+        def pieces(s:STATEMENT) -> List[STATEMENT]:
+            if id(s) not in splits:
+                splits[id(s)] = (s, s.split())
+            return splits[id(s)][1]
+        def size(s:STATEMENT) -> float:
+            if id(s) not in sizes:
+                sizes[id(s)] = cost(s)
+            return sizes[id(s)]
+        def bound(s:STATEMENT) -> float:
+            if id(s) not in bounds:
+                p = pieces(s)
+                bounds[id(s)] = size(s) if len(p) < 2 else sum(bound(x) for x in p)
+            return bounds[id(s)]
+        def blank(statements:List[STATEMENT]) -> bool:
+            return all(isinstance(s, EMPTY) for s in statements)
         
+        trigger = cost(ASYNC_TRIG_MACRO(f'{self.name}0'))
+        base = sum(cost(s) for s in prologue) + trigger
+        # Stateless statements are shared instances, they can't be told apart from the body
+        skipped = {id(p) for p in prologue if not isinstance(p, STATELESS)}
+        pending = self._units([s for s in self._body() if id(s) not in skipped])
+        pending.reverse()
+        parts:List[List[STATEMENT]] = [[]]
+        used = base
+        while pending:
+            unit = pending.pop()
+            splittable = len(unit) == 1 and len(pieces(unit[0])) > 1
+            # Text too long even for an empty part is split without costing the whole of it
+            if splittable and additive and base + bound(unit[0]) > budget:
+                pending.extend(reversed([[p] for p in pieces(unit[0])]))
+                continue
+            weight = sum(size(s) for s in unit)
+            if used + weight > budget:
+                if splittable and base + weight > budget:
+                    pending.extend(reversed([[p] for p in pieces(unit[0])]))
+                    continue
+                # Blank lines go with the next unit rather than leave a part of their own
+                if not blank(parts[-1]):
+                    parts.append([])
+                    used = base
+            parts[-1].extend(unit)
+            used += weight
+        
+        if len(parts) == 1:
+            names = [self.name]
+        else:
+            names = [f'{self.name}{i}' for i in range(len(parts))]
+        macros:List[Macro] = []
+        for i, (name, statements) in enumerate(zip(names, parts)):
+            while statements and isinstance(statements[0], EMPTY):
+                statements.pop(0)
+            while statements and isinstance(statements[-1], EMPTY):
+                statements.pop()
+            m = Macro(name, self.description)
+            m._maxlen = self._maxlen
+            m.begin()
+            if len(prologue) > 0:
+                m.write(*prologue, EMPTY())
+            m.write(*statements)
+            if i + 1 < len(names):
+                m.write(EMPTY(), ASYNC_TRIG_MACRO(names[i + 1]))
+            m.end()
+            macros.append(m)
+        return macros
+        
+def statement_size(statement:STATEMENT) -> int:
+    """Length of the text generated for a statement inside a macro."""
+    scratch = Macro('', '')
+    scratch.indentation = 1
+    statement.compile(scratch)
+    return sum(len(l) for l in scratch._lines)
+
 
 class CONDITIONAL(STATEMENT):
+    __slots__ = ('condition', 'onTrue', 'onFalse')
     def __init__(self, condition:Union[bool, Callable[[], bool]], 
                  onTrue:List[STATEMENT]=None, onFalse:List[STATEMENT]=None):
         super().__init__()
@@ -796,8 +1108,22 @@ class CONDITIONAL(STATEMENT):
             if self.onFalse is not None:
                 for s in self.onFalse:
                     s.bake(macro)
+    
+    def compile(self, macro:Macro):
+        if self.result:
+            if self.onTrue is not None:
+                for s in self.onTrue:
+                    s.compile(macro)
+        else:
+            if self.onFalse is not None:
+                for s in self.onFalse:
+                    s.compile(macro)
+                    
+    def blocks(self) -> List[List[STATEMENT]]:
+        return [b for b in (self.onTrue, self.onFalse) if b is not None]
 
 class TON(STATEMENT):
+    __slots__ = ('timer', 'body')
     def __init__(self, timer:TIMER):
         self.timer = timer
         super().__init__(timer)
@@ -807,7 +1133,7 @@ class TON(STATEMENT):
                 self.timer.TT.set(True),
                 self.timer.DN.set(False),
             ),
-            IF(~self.timer.DN & self.timer.ACC <= self.timer.PRE)(
+            IF(~self.timer.DN & (self.timer.ACC <= self.timer.PRE))(
                 self.timer.ACC.set(self.timer.ACC + 100)
             ).ELSE()(
                 self.timer.DN.set(True),
@@ -824,8 +1150,96 @@ class TON(STATEMENT):
         
     def process(self, macro:Macro):
         self.body.process(macro)
+        
+    def compile(self, macro:Macro):
+        self.body.compile(macro)
+        
+    def blocks(self) -> List[List[STATEMENT]]:
+        return self.body.blocks()
+
+class SWITCH(STATEMENT):
+    __slots__ = ('index', 'cases', 'default', 'body', '_assigned')
+    def __init__(self, index:Union[Variable[int], EXPRESSION], cases:Dict[int, Union[STATEMENT, List[STATEMENT]]], 
+                 default:List[STATEMENT] = None):
+        super().__init__()
+        self.index = index
+        self.cases = cases
+        self.default = default
+        self._assigned:bool = None
+        values = sorted(cases.keys())
+        if len(values) == 0:
+            raise ValueError('SWITCH needs at least one case.')
+        self.body = self._dispatch(values, cases)
+        if default is not None:
+            # The default runs once when no case matched, instead of in every leaf
+            self.body = IF(self._matches(values))(self.body).ELSE()(*default)
+    
+    def _dispatch(self, values:List[int], cases:Dict[int, Union[STATEMENT, List[STATEMENT]]]) -> STATEMENT:
+        if len(values) == 1:
+            case = cases[values[0]]
+            body = [case] if isinstance(case, STATEMENT) else case
+            return IF(self.index == values[0])(*body)
+        # Split on the middle value to keep the comparison count logarithmic
+        mid = len(values) // 2
+        return IF(self.index < values[mid])(
+            self._dispatch(values[:mid], cases)
+        ).ELSE()(
+            self._dispatch(values[mid:], cases)
+        )
+    
+    def _matches(self, values:List[int]) -> EXPRESSION:
+        # One comparison per run of consecutive values
+        runs:List[List[int]] = []
+        for v in values:
+            if runs and v == runs[-1][1] + 1:
+                runs[-1][1] = v
+            else:
+                runs.append([v, v])
+        terms = [self.index == a if a == b else AND(self.index >= a, self.index <= b) for a, b in runs]
+        return terms[0] if len(terms) == 1 else OR(*terms)
+    
+    def bake(self, macro:Macro):
+        self.body.bake(macro)
+        
+    def process(self, macro:Macro):
+        self.body.process(macro)
+        
+    def compile(self, macro:Macro):
+        self.body.compile(macro)
+        
+    def blocks(self) -> List[List[STATEMENT]]:
+        return self.body.blocks()
+    
+    def split(self) -> List[STATEMENT]:
+        # Running both halves one after the other only matches one case if no case changes the index
+        values = sorted(self.cases.keys())
+        if len(values) < 2 or self.default is not None or not isinstance(self.index, Variable) or self._assigns_index():
+            return [self]
+        mid = len(values) // 2
+        halves = [SWITCH(self.index, {v: self.cases[v] for v in half}) for half in (values[:mid], values[mid:])]
+        # The halves hold a part of the same cases, no need to walk them again
+        for h in halves:
+            h._assigned = False
+        return halves
+    
+    def _assigns_index(self) -> bool:
+        if self._assigned is None:
+            self._assigned = self._walk_assigns_index()
+        return self._assigned
+    
+    def _walk_assigns_index(self) -> bool:
+        stack = [*self.body.blocks()]
+        while stack:
+            for s in stack.pop():
+                if isinstance(s, ASSIGNEMENT) and s.var is self.index:
+                    return True
+                if isinstance(s, CALL) and any(p is self.index for p in s.params):
+                    return True
+                stack.extend(s.blocks())
+        return False
 
 class TIMER(Resource):
+    __slots__ = ('name', 'EN', 'TT', 'DN', 'PRE', 'ACC')
     def __init__(self, name:str):
         self.name = name
         self.EN = vbool(f'{name}_EN')
@@ -889,6 +1303,12 @@ def MAX(arr:Variable[DT], result:Variable[DT], count:int = 1) -> CALL:
     return CALL('MAX', arr, result, count)
 
 def C_MIN(a:Union[DT, Variable[DT]], b:Union[DT, Variable[DT]], r:Variable[DT]) -> STATEMENT:
+    if a is b:
+        return r.set(a)
+    if r is a:
+        return IF(a > b)(r.set(b))
+    if r is b:
+        return IF(b > a)(r.set(a))
     if isinstance(a, Variable):
         return IF(a <= b)(r.set(a)).ELSE()(r.set(b))
     if isinstance(b, Variable):
@@ -898,6 +1318,12 @@ def C_MIN(a:Union[DT, Variable[DT]], b:Union[DT, Variable[DT]], r:Variable[DT])
     return r.set(b)
 
 def C_MAX(a:Union[DT, Variable[DT]], b:Union[DT, Variable[DT]], r:Variable[DT]) -> STATEMENT:
+    if a is b:
+        return r.set(a)
+    if r is a:
+        return IF(a < b)(r.set(b))
+    if r is b:
+        return IF(b < a)(r.set(a))
     if isinstance(a, Variable):
         return IF(a > b)(r.set(a)).ELSE()(r.set(b))
     if isinstance(b, Variable):
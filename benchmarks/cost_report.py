@@ -0,0 +1,50 @@
+"""Static cost report of every generated macro.
+
+Run with ``python benchmarks/cost_report.py [--output report.json] [--baseline report.json]``.
+With a baseline, exits with status 1 when a macro needs more PLC round trips
+than it did in the baseline.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import cost
+import generate  # registers the generators
+import registry
+
+
+def reports() -> List[Dict[str, Any]]:
+    return [cost.analyze(macro).as_dict() for g in registry.select() for macro in g()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    parser.add_argument('--baseline', help='JSON report to compare the PLC round trips against')
+    args = parser.parse_args()
+    
+    result = reports()
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as wr:
+            wr.write(text)
+    else:
+        print(text)
+    
+    if args.baseline:
+        with open(args.baseline) as rd:
+            baseline = {r['name']: r for r in json.load(rd)}
+        problems = [p for r in result if r['name'] in baseline for p in cost.regressions(baseline[r['name']], r)]
+        for p in problems:
+            print(p, file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Per-node memory footprint of the macro tree built by generate_sim_tank (first part).
+
+Run with ``python benchmarks/memory.py``.
+"""
+from __future__ import annotations
+import os
+import sys
+import tracemalloc
+from collections import Counter
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import api
+import generate  # registers the generators
+import registry
+
+
+def capture(name:str) -> api.Macro:
+    """Runs a registered generator and returns its (first) macro."""
+    return capture_all(name)[0]
+
+
+def capture_all(name:str) -> List[api.Macro]:
+    """Runs a registered generator and returns all its macros."""
+    return registry.GENERATORS[name]()
+
+
+def _attributes(node:object):
+    if hasattr(node, '__dict__'):
+        yield from vars(node).values()
+    for cls in type(node).__mro__:
+        for slot in getattr(cls, '__slots__', ()):
+            if hasattr(node, slot):
+                yield getattr(node, slot)
+
+
+def footprint(node:object) -> int:
+    """Bytes held by the node itself, its __dict__ and its containers."""
+    size = sys.getsizeof(node)
+    if hasattr(node, '__dict__'):
+        size += sys.getsizeof(vars(node))
+    for v in _attributes(node):
+        if isinstance(v, (list, tuple, set)) and len(v) > 0:
+            size += sys.getsizeof(v)
+    # The empty tuple is shared, an empty list is not
+    for v in _attributes(node):
+        if isinstance(v, list) and len(v) == 0:
+            size += sys.getsizeof(v)
+    return size
+
+
+def walk(macro:api.Macro) -> Dict[type, List[object]]:
+    nodes:Dict[type, List[object]] = {}
+    seen = set()
+    stack:List[object] = list(macro.statements)
+    while stack:
+        n = stack.pop()
+        if id(n) in seen:
+            continue
+        seen.add(id(n))
+        if not isinstance(n, (api.Resource, api.STATEMENT)):
+            continue
+        nodes.setdefault(type(n), []).append(n)
+        for v in _attributes(n):
+            if isinstance(v, (list, tuple, set)):
+                stack.extend(v)
+            else:
+                stack.append(v)
+    return nodes
+
+
+def main():
+    tracemalloc.start()
+    macro = capture('sim_tank')
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    nodes = walk(macro)
+    counts = Counter({cls: len(n) for cls, n in nodes.items()})
+    total_nodes = sum(counts.values())
+    total_bytes = 0
+    print(f'{"class":<20}{"count":>8}{"bytes/node":>12}{"total":>10}')
+    for cls, count in counts.most_common():
+        size = sum(footprint(n) for n in nodes[cls])
+        total_bytes += size
+        print(f'{cls.__name__:<20}{count:>8}{size / count:>12.1f}{size:>10}')
+    print()
+    print(f'nodes: {total_nodes}')
+    print(f'node bytes: {total_bytes} ({total_bytes / total_nodes:.1f} per node)')
+    print(f'peak traced memory while building: {peak}')
+
+
+if __name__ == '__main__':
+    main()
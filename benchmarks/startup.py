@@ -0,0 +1,59 @@
+"""Import time of the generator modules, measured with ``python -X importtime``.
+
+Every module is imported in a fresh interpreter, so the numbers include all
+of its dependencies. The run fails if one of them pulls in a module of
+HEAVY, which only the code paths that need them (the clipboard, the pyvis
+view of the pipe graph) may import.
+
+Run with ``python benchmarks/startup.py [MODULE ...] [--top N]``.
+"""
+from __future__ import annotations
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+MODULES = ('api', 'optimize', 'generate', 'registry', 'build', 'cost', 'pipe', 'alarms')
+HEAVY = ('tkinter', 'pyvis', 'pyperclip', 'jinja2', 'networkx')
+
+
+def importtime(module:str) -> List[Tuple[str, int, int]]:
+    """Returns (module, self us, cumulative us) of everything importing module imports."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{proc.stderr}')
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((name.strip(), int(self_us), int(cumulative)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the import time of the generator modules.')
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('--top', type=int, default=5, help='slowest imports to show per module')
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        rows = importtime(module)
+        total = next(c for name, _, c in reversed(rows) if name == module)
+        heavy = sorted({name for name, _, _ in rows if name.split('.')[0] in HEAVY})
+        print(f'{module:<10}{total / 1000:8.1f} ms  {len(rows)} modules')
+        for name, self_us, _ in sorted(rows, key=lambda r: -r[1])[:args.top]:
+            print(f'    {self_us / 1000:8.1f} ms  {name}')
+        if heavy:
+            print(f'    imports {", ".join(heavy)}')
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
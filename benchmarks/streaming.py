@@ -0,0 +1,44 @@
+"""Peak memory of compile() against bake_to() on the unpartitioned sim tank macro.
+
+The macro tree is built first, so the numbers only count the emission.
+
+Run with ``python benchmarks/streaming.py``.
+"""
+from __future__ import annotations
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from generate import generate_sim_tank
+
+
+def measure(emit:Callable[[], object]) -> Tuple[int, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    emit()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, seconds
+
+
+def main():
+    # A budget large enough to keep every tank in one macro
+    [compiled] = generate_sim_tank(sys.maxsize)
+    [streamed] = generate_sim_tank(sys.maxsize)
+    with open(os.devnull, 'w') as devnull:
+        results = {
+            'compile': measure(compiled.compile),
+            'bake_to': measure(lambda: streamed.bake_to(devnull)),
+        }
+    print(f'output: {len(compiled.compile())} characters')
+    for name, (peak, seconds) in results.items():
+        print(f'{name:<10}peak {peak:>10} bytes  {seconds * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
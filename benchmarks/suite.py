@@ -0,0 +1,191 @@
+"""Timing suite of the generators, the pipe graph and the alarm export.
+
+Every case is timed a few times and the best and median times are kept:
+
+    build:<generator>     running a registered generator (tree construction)
+    compile:<generator>   compiling the macros it returned
+    pipe:graph            building pipe.Graph from the pump
+    pipe:generate_code    generating the pipe animation macro
+    alarms:write_valves   writing the valve alarm table
+    scale:<generator>     building and compiling with 1,000 tanks or 10,000 valves
+    scale:reset_values    clearing 10,000 selection flags
+
+The results are saved as benchmarks/results/<commit>.json (with a -dirty
+suffix when the tree has uncommitted changes). --compare takes a commit or a
+results file and exits with status 1 when a case got slower than --threshold
+times its old median.
+
+Run with ``python benchmarks/suite.py [CASE ...] [--repeat N] [--compare COMMIT]``.
+"""
+from __future__ import annotations
+import argparse
+import contextlib
+import fnmatch
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterator, List
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+RESULTS = os.path.join(os.path.dirname(__file__), 'results')
+sys.path.insert(0, ROOT)
+
+import generate  # registers the generators
+import registry
+
+SCALE_TANKS = 1000
+SCALE_VALVES = 10000
+
+
+class Case:
+    """setup() prepares the inputs and returns the function to time."""
+    def __init__(self, name:str, setup:Callable[[], Callable[[], Any]], repeat:int = None):
+        self.name = name
+        self.setup = setup
+        self.repeat = repeat
+
+    def run(self, repeat:int) -> Dict[str, Any]:
+        times = []
+        for _ in range(self.repeat or repeat):
+            function = self.setup()
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        return {'best': min(times), 'median': statistics.median(times), 'runs': len(times)}
+
+
+@contextlib.contextmanager
+def scaled(tanks:int = None, valves:int = None) -> Iterator[None]:
+    """Replaces the tank and valve lists the generators read with synthetic ones."""
+    saved = generate.tanks, generate.valves
+    if tanks is not None:
+        generate.tanks = [f'{saved[0][i % len(saved[0])]}_{i}' for i in range(tanks)]
+    if valves is not None:
+        generate.valves = [f'V{i:05d}' for i in range(valves)]
+    try:
+        yield
+    finally:
+        generate.tanks, generate.valves = saved
+
+
+def _compile(g:registry.Generator):
+    macros = g()
+    return lambda: [m.compile() for m in macros]
+
+def _scale(g:registry.Generator, **sizes:int):
+    def run():
+        with scaled(**sizes):
+            for m in g():
+                m.compile()
+    return run
+
+def _graph():
+    import pipe
+    return lambda: pipe.Graph(pipe.PumpMerge)
+
+def _generate_code():
+    import pipe
+    g = pipe.Graph(pipe.PumpMerge)
+    return lambda: pipe.generate_code(g, io.StringIO())
+
+def _write_valves():
+    import alarms
+    path = os.path.join(tempfile.mkdtemp(), 'valves.csv')
+    main = alarms.Main(os.devnull, path)
+    return lambda: main.write_valves(clipboard=False)
+
+
+def cases() -> List[Case]:
+    generators = registry.select()
+    res = [Case(f'build:{g.name}', lambda g=g: g) for g in generators]
+    res += [Case(f'compile:{g.name}', lambda g=g: _compile(g)) for g in generators]
+    res += [
+        Case('pipe:graph', _graph),
+        Case('pipe:generate_code', _generate_code),
+        Case('alarms:write_valves', _write_valves),
+    ]
+    for name in ('update_tank', 'write_tank', 'sim_tank'):
+        g = registry.GENERATORS[name]
+        res.append(Case(f'scale:{name}', lambda g=g: _scale(g, tanks=SCALE_TANKS), repeat=1))
+    for name in ('read_valve', 'send_valve'):
+        g = registry.GENERATORS[name]
+        res.append(Case(f'scale:{name}', lambda g=g: _scale(g, valves=SCALE_VALVES), repeat=1))
+    flags = registry.Generator('reset_values', generate.reset_values,
+                               ([f'V{i:05d}' for i in range(SCALE_VALVES)], 'ResetValues'))
+    res.append(Case('scale:reset_values', lambda: _scale(flags), repeat=1))
+    return res
+
+
+def commit() -> str:
+    def git(*args:str) -> str:
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    head = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    return head + ('-dirty' if git('status', '--porcelain', '--untracked-files=no') else '')
+
+def load(reference:str) -> Dict[str, Any]:
+    path = reference if os.path.exists(reference) else os.path.join(RESULTS, f'{reference}.json')
+    with open(path) as rd:
+        return json.load(rd)
+
+def compare(old:Dict[str, Any], new:Dict[str, Any], threshold:float) -> List[str]:
+    """Describes every case whose median got slower than threshold times the old one."""
+    slower = []
+    for name, r in new['cases'].items():
+        before = old['cases'].get(name)
+        if before is not None and r['median'] > before['median'] * threshold:
+            slower.append(f'{name}: {before["median"] * 1000:.1f} ms -> {r["median"] * 1000:.1f} ms')
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cases', nargs='*', default=['*'], help='names or glob patterns (default: all)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case (scale cases run once)')
+    parser.add_argument('--compare', help='commit or results file to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio reported by --compare')
+    parser.add_argument('--list', action='store_true', help='list the cases and exit')
+    args = parser.parse_args()
+
+    selected = [c for c in cases() if any(fnmatch.fnmatchcase(c.name, p) for p in args.cases)]
+    if args.list:
+        for c in selected:
+            print(c.name)
+        return
+
+    old = load(args.compare) if args.compare else None
+    result = {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cases': {},
+    }
+    for c in selected:
+        r = c.run(args.repeat)
+        result['cases'][c.name] = r
+        print(f'{c.name:<28}{r["best"] * 1000:10.2f} ms {r["median"] * 1000:10.2f} ms')
+
+    os.makedirs(RESULTS, exist_ok=True)
+    path = os.path.join(RESULTS, f'{result["commit"]}.json')
+    # Running a subset of the cases keeps the others of the same commit
+    if os.path.exists(path):
+        result['cases'] = {**load(path)['cases'], **result['cases']}
+    with open(path, 'w') as wr:
+        json.dump(result, wr, indent=2)
+    print(f'saved {os.path.relpath(path, ROOT)}')
+
+    if old is not None:
+        slower = compare(old, result, args.threshold)
+        for s in slower:
+            print(s, file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Builds the generated macros into an output directory.
+
+Every generator's inputs are fingerprinted: its source and the source of the
+helpers it calls in the same module, the configuration tables they read
+(tanks, valves, TANK_VALVES_MAP, ...), its arguments, and api.py/optimize.py.
+A generator whose fingerprint did not change since the last build, and whose
+files are still there, is skipped. The others run in parallel in a process
+pool, and a manifest.json with the files and timings of the build is written
+next to the macros.
+
+Run with ``python build.py [GENERATOR ...] [--output DIR] [--force] [--jobs N]``.
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import CodeType, FunctionType
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+import api
+import generate  # registers the generators
+import optimize
+from registry import GENERATORS, Generator, select
+
+
+CACHE_NAME = '.build-cache.json'
+MANIFEST_NAME = 'manifest.json'
+
+# Modules every generator depends on
+LIBRARIES = (api, optimize)
+
+
+def _names(code:CodeType) -> Iterator[str]:
+    yield from code.co_names
+    # Comprehensions and lambdas have their own code objects
+    for c in code.co_consts:
+        if isinstance(c, CodeType):
+            yield from _names(c)
+
+def _data(value:Any) -> Any:
+    """A JSON-able form of a configuration value. Objects only count by their type."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_data(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((_data(v) for v in value), key=repr)
+    if isinstance(value, dict):
+        return sorted(([_data(k), _data(v)] for k, v in value.items()), key=repr)
+    return f'<{type(value).__name__}>'
+
+def _hash_function(h:'hashlib._Hash', func:FunctionType, seen:Set[FunctionType]):
+    if func in seen:
+        return
+    seen.add(func)
+    h.update(inspect.getsource(func).encode())
+    # Defaults are bound when the function is defined, their names are not in co_names
+    defaults = [*(func.__defaults__ or ()), *(func.__kwdefaults__ or {}).values()]
+    for value in defaults:
+        if isinstance(value, FunctionType):
+            _hash_function(h, value, seen)
+    h.update(json.dumps(_data(func.__defaults__)).encode())
+    h.update(json.dumps(_data(func.__kwdefaults__)).encode())
+    for name in sorted(set(_names(func.__code__))):
+        if name not in func.__globals__:
+            continue
+        value = func.__globals__[name]
+        if isinstance(value, FunctionType):
+            if value.__module__ == func.__module__:
+                _hash_function(h, value, seen)
+        elif not isinstance(value, type) and not inspect.ismodule(value):
+            h.update(json.dumps([name, _data(value)]).encode())
+
+def fingerprint(generator:Generator) -> str:
+    """Hash of everything the output of the generator depends on."""
+    h = hashlib.sha256()
+    for module in LIBRARIES:
+        with open(module.__file__, 'rb') as rd:
+            h.update(rd.read())
+    h.update(json.dumps(_data(generator.args)).encode())
+    _hash_function(h, generator.function, set())
+    return h.hexdigest()
+
+def write(macros:List[api.Macro], output:str) -> List[str]:
+    files = []
+    for m in macros:
+        name = f'{m.name}.txt'
+        m.save(os.path.join(output, name))
+        files.append(name)
+    return files
+
+def _build_one(generator:Generator, output:str) -> Tuple[List[str], float]:
+    start = time.perf_counter()
+    files = write(generator(), output)
+    return files, time.perf_counter() - start
+
+def build(output:str, generators:List[Generator] = None,
+          force:bool = False, jobs:int = None) -> Dict[str, Any]:
+    """Writes the macros of every generator into output, skipping the unchanged ones.
+
+    The generators to rebuild run in up to jobs processes (one per CPU by
+    default, in this process if jobs is 1). Returns the manifest: for every
+    generator the files it owns, whether they came from the cache and how long
+    it took, plus the wall time of the whole build.
+    """
+    start = time.perf_counter()
+    os.makedirs(output, exist_ok=True)
+    path = os.path.join(output, CACHE_NAME)
+    cache:Dict[str, Dict[str, Any]] = {}
+    if os.path.exists(path) and not force:
+        with open(path) as rd:
+            cache = json.load(rd)
+
+    generators_:Dict[str, Dict[str, Any]] = {}
+    stale:List[Tuple[Generator, str]] = []
+    for generator in generators or list(GENERATORS.values()):
+        k = generator.name
+        digest = fingerprint(generator)
+        entry = cache.get(k)
+        if entry is not None and entry['fingerprint'] == digest \
+                and all(os.path.exists(os.path.join(output, f)) for f in entry['files']):
+            generators_[k] = {'files': entry['files'], 'cached': True, 'seconds': 0.0}
+        else:
+            generators_[k] = None
+            stale.append((generator, digest))
+
+    if jobs == 1 or len(stale) <= 1:
+        results = [_build_one(generator, output) for generator, _ in stale]
+    else:
+        with ProcessPoolExecutor(jobs) as pool:
+            futures = [pool.submit(_build_one, generator, output) for generator, _ in stale]
+            results = [f.result() for f in futures]
+
+    for (generator, digest), (files, seconds) in zip(stale, results):
+        k = generator.name
+        entry = cache.get(k)
+        # A generator can produce fewer parts than last time
+        for old in set(entry['files'] if entry else []) - set(files):
+            if os.path.exists(os.path.join(output, old)):
+                os.remove(os.path.join(output, old))
+        cache[k] = {'fingerprint': digest, 'files': files}
+        generators_[k] = {'files': files, 'cached': False, 'seconds': round(seconds, 4)}
+
+    with open(path, 'w') as wr:
+        json.dump(cache, wr, indent=2)
+    manifest = {
+        'generators': generators_,
+        'seconds': round(time.perf_counter() - start, 4),
+    }
+    with open(os.path.join(output, MANIFEST_NAME), 'w') as wr:
+        json.dump(manifest, wr, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds the generated macros into an output directory.')
+    parser.add_argument('generators', nargs='*', default=['*'], help='names or glob patterns (default: all)')
+    parser.add_argument('--output', default='out', help='directory to write the macros to (default: out)')
+    parser.add_argument('--force', action='store_true', help='ignore the cache and rebuild everything')
+    parser.add_argument('--jobs', type=int, help='number of processes (default: one per CPU)')
+    args = parser.parse_args()
+
+    try:
+        selected = select(args.generators)
+    except KeyError as e:
+        parser.error(e.args[0])
+    manifest = build(args.output, selected, force=args.force, jobs=args.jobs)
+    for k, r in manifest['generators'].items():
+        status = 'cached' if r['cached'] else f'{r["seconds"]:.2f}s'
+        print(f'{status:<8}{k}: {", ".join(r["files"])}')
+    print(f'{manifest["seconds"]:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""Static cost model of generated macros.
+
+analyze() walks the statement tree of a Macro without running it and counts
+the device transfers, calls, operators, DELAYs and if nesting, then estimates
+the time of one run from per-operation latencies (in milliseconds).
+"""
+from __future__ import annotations
+import json
+import re
+from collections import Counter
+from typing import Any, Dict, List
+
+from api import *
+
+
+# Estimated time of each operation in milliseconds
+LATENCIES:Dict[str, float] = {
+    'PLC': 15.0,        # one GetData/SetData round-trip to the PLC
+    'HMI': 0.2,         # one GetData/SetData of a local HMI tag
+    'call': 0.05,       # any other function call (DELAY adds its own duration)
+    'assignment': 0.01,
+    'operator': 0.005,
+}
+
+DEVICES = {PLC_NAME: 'PLC', HMI_NAME: 'HMI'}
+TRANSFERS = ('GetData', 'GetDataEx', 'SetData', 'SetDataEx')
+
+ARITHMETIC = re.compile(r' ([-+*/]) ')
+
+def device(name:str) -> str:
+    return DEVICES.get(name, name)
+
+def operators(expression:Any) -> Counter:
+    """Counts the operators of an expression by their generated symbol."""
+    counts:Counter = Counter()
+    stack = [expression]
+    while stack:
+        e = stack.pop()
+        if isinstance(e, (AND, OR)):
+            counts['and' if isinstance(e, AND) else 'or'] += len(e._expressions) - 1
+            stack.extend(e._expressions)
+        elif isinstance(e, NOT):
+            counts['not'] += 1
+            stack.append(e.expression)
+        elif isinstance(e, COMPARE):
+            counts[e.operator] += 1
+            stack.extend((e.left, e.right))
+        elif isinstance(e, LITERAL):
+            # Arithmetic literals already contain the text of their operands
+            counts.update(ARITHMETIC.findall(e.literal))
+    return counts
+
+
+class CostReport:
+    """Counts and time estimate of one macro. as_dict()/to_json() give the machine-readable form."""
+    def __init__(self, name:str, latencies:Dict[str, float]):
+        self.name = name
+        self.latencies = latencies
+        self.calls:Dict[str, Counter] = {}
+        self.operators:Counter = Counter()
+        self.max_depth = 0
+        self.delay_total = 0
+        self.worst_case = 0.0
+        self.branches:List[Dict[str, Any]] = []
+
+    @property
+    def round_trips(self) -> Counter:
+        """GetData/SetData calls (and their Ex versions) by device."""
+        trips:Counter = Counter()
+        for name in TRANSFERS:
+            trips.update(self.calls.get(name, {}))
+        return trips
+
+    @property
+    def plc_round_trips(self) -> int:
+        return self.round_trips['PLC']
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'plc_round_trips': self.plc_round_trips,
+            'round_trips': dict(self.round_trips),
+            'calls': {name: dict(devices) for name, devices in sorted(self.calls.items())},
+            'operators': dict(sorted(self.operators.items())),
+            'max_depth': self.max_depth,
+            'delay_total': self.delay_total,
+            'worst_case': round(self.worst_case, 3),
+            'branches': self.branches,
+            'latencies': dict(self.latencies),
+        }
+
+    def to_json(self, indent:int = 2) -> str:
+        return json.dumps(self.as_dict(), indent=indent)
+
+    def __str__(self) -> str:
+        trips = ', '.join(f'{d}: {n}' for d, n in sorted(self.round_trips.items()))
+        return '\n'.join([
+            f'{self.name}',
+            f'    round trips     {trips}',
+            f'    operators       {sum(self.operators.values())}',
+            f'    max if depth    {self.max_depth}',
+            f'    DELAY total     {self.delay_total} ms',
+            f'    branches        {len(self.branches)}',
+            f'    worst case      {self.worst_case:.2f} ms',
+        ])
+
+
+class _Chain:
+    """An if/else if/else chain being walked."""
+    def __init__(self, before:float, depth:int):
+        self.before = before
+        self.tests = 0.0
+        self.condition = ''
+        self.depth = depth
+        self.paths:List[float] = []
+        self.has_else = False
+        self.entry = 0.0
+
+    def test(self, cost:float, condition:str):
+        self.tests += cost
+        self.entry = self.tests
+        self.condition = condition
+
+    def close(self, body:float, report:CostReport):
+        report.branches.append({'condition': self.condition, 'depth': self.depth, 'cost': round(body, 3)})
+        self.paths.append(self.entry + body)
+
+    def worst(self) -> float:
+        # Without an else, running none of the branches still evaluates every condition
+        worst = max(self.paths, default=0.0)
+        return self.before + (worst if self.has_else else max(worst, self.tests))
+
+
+class _Analyzer:
+    def __init__(self, report:CostReport):
+        self.report = report
+        self.latencies = report.latencies
+
+    def expression(self, expression:Any) -> float:
+        counts = operators(expression)
+        self.report.operators.update(counts)
+        return sum(counts.values()) * self.latencies['operator']
+
+    def block(self, statements:List[STATEMENT], depth:int) -> float:
+        chains:List[_Chain] = []
+        current = 0.0
+        for s in statements:
+            if isinstance(s, C_IF):
+                chain = _Chain(current, depth + len(chains) + 1)
+                chain.test(self.expression(s.condition), str(s.condition))
+                chains.append(chain)
+                self.report.max_depth = max(self.report.max_depth, chain.depth)
+                current = 0.0
+            elif isinstance(s, C_ELIF) and chains:
+                chains[-1].close(current, self.report)
+                chains[-1].test(self.expression(s.condition), str(s.condition))
+                current = 0.0
+            elif isinstance(s, C_ELSE) and chains:
+                chains[-1].close(current, self.report)
+                chains[-1].has_else = True
+                chains[-1].entry = chains[-1].tests
+                chains[-1].condition = 'else'
+                current = 0.0
+            elif isinstance(s, C_END_IF) and chains:
+                chain = chains.pop()
+                chain.close(current, self.report)
+                current = chain.worst()
+            else:
+                current += self.statement(s, depth + len(chains))
+        # Containers close their last if when baked, not in their content
+        while chains:
+            chain = chains.pop()
+            chain.close(current, self.report)
+            current = chain.worst()
+        return current
+
+    def statement(self, s:STATEMENT, depth:int) -> float:
+        if isinstance(s, CALL):
+            return self.call(s)
+        if isinstance(s, ASSIGNEMENT):
+            return self.latencies['assignment'] + self.expression(s.value)
+        if isinstance(s, RETURN):
+            return self.expression(s.ret)
+        if isinstance(s, CONDITIONAL):
+            chosen = s.onTrue if s.result else s.onFalse
+            return 0.0 if chosen is None else self.block(chosen, depth)
+        return sum(self.block(b, depth) for b in s.blocks())
+
+    def call(self, s:CALL) -> float:
+        if s.funcName in TRANSFERS and len(s.params) >= 2:
+            target = device(s.params[1])
+            self.report.calls.setdefault(s.funcName, Counter())[target] += 1
+            return self.latencies.get(target, self.latencies['PLC'])
+        self.report.calls.setdefault(s.funcName, Counter())['-'] += 1
+        cost = self.latencies['call']
+        if s.funcName == 'DELAY' and isinstance(s.params[0], (int, float)):
+            self.report.delay_total += s.params[0]
+            cost += s.params[0]
+        return cost
+
+
+def analyze(macro:Macro, latencies:Dict[str, float] = None) -> CostReport:
+    """Returns the static cost report of a macro.
+
+    latencies overrides entries of LATENCIES. Transfers to a device that has no
+    entry of its own cost as much as a PLC transfer. The worst case follows
+    the most expensive branch of every if, counts every condition tested to
+    reach it and ignores early returns, so it is an upper bound of one run.
+    """
+    report = CostReport(macro.name, {**LATENCIES, **(latencies or {})})
+    report.worst_case = _Analyzer(report).block(macro.statements, 0)
+    return report
+
+def estimate(statement:STATEMENT, latencies:Dict[str, float] = None) -> float:
+    """Worst-case time of a single statement, usable as the cost of Macro.partition.
+
+    Only one case of a SWITCH runs, so it costs about as much as one of its halves.
+    """
+    report = CostReport('', {**LATENCIES, **(latencies or {})})
+    return _Analyzer(report).block([statement], 0)
+
+def regressions(baseline:Dict[str, Any], report:Dict[str, Any],
+                keys:List[str] = ('plc_round_trips',)) -> List[str]:
+    """Describes every key of two report dicts that went up from the baseline."""
+    return [f'{report["name"]}: {k} {baseline[k]} -> {report[k]}'
+            for k in keys if k in baseline and report[k] > baseline[k]]
@@ -1,12 +1,19 @@
 from base64 import decodebytes, encodebytes
 import itertools
-from time import sleep
-from typing import Dict
+from typing import Dict, List
 from api import *
+from optimize import coalesce_reads, eliminate_common_subexpressions, eliminate_dead_writes, eliminate_redundant_reads, simplify_expressions
+from registry import generator, main
 
 
 # Define global variables
 LOADING_FLAG_NAME = "LoadingPage"
+# Largest macro text the HMI is given in one piece, bigger macros are split
+MACRO_MAX_SIZE = 100000
+TANK_INDEX_NAME = "TankIndex"
+VALVE_INDEX_NAME = "ValveIndex"
+# Index value no case matches, nothing is selected
+NO_SELECTION = -1
 
 # Define tank names and commands
 tanks = [
@@ -69,7 +76,8 @@ def strip_dot(name:str) -> str:
         return name.split('.')[-1]
     return name
 
-def generate_load_tank_values():
+@generator('load_tank')
+def generate_load_tank_values() -> Macro:
     m = Macro('LoadTankValues', 'Resets all the values for the tank screen')
     
     m.begin()
@@ -104,10 +112,10 @@ def generate_load_tank_values():
     m.write(EMPTY())
 
     m.end()
-    m.display()
-    m.clipboard()
+    return m
 
-def generate_update_tank_values():
+@generator('update_tank')
+def generate_update_tank_values() -> Macro:
     m = Macro('UpdateTankValues', 'Updates the values for the tank screen')
     
     m.begin()
@@ -118,18 +126,19 @@ def generate_update_tank_values():
     maxReq = vfloat('maxReq')
     minReq = vfloat('minReq')
     req = vfloat('req')
-    tankSelected = vbool('tankSelected')
+    tankIndex = vshort('tankIndex')
     loading = vbool('loading')
+    cases = {}
     
-    for tank in tanks:
-        m.write(
+    m.write(GetData(tankIndex, HMI_NAME, TANK_INDEX_NAME))
+    for i, tank in enumerate(tanks):
+        case = cases[i] = BLOCK()
+        case.write(
             COMMENT(f'{tank} Tank'),
-            GetData(tankSelected, HMI_NAME, tank),
-            C_IF(tankSelected),
             COMMENT('Update commands'),
         )
         
-        m.write(
+        case.write(
             EMPTY(),
             COMMENT('Update Qty Values'),
             GetData(total, PLC_NAME, f'{tank}.QtyF.ActT'),
@@ -161,13 +170,13 @@ def generate_update_tank_values():
                         continue
                 plc_tag = f"{tank}.{command}.{plc_val}"
                 hmi_tag = f"Tank{strip_dot(command)}{hmi_val}"
-                m.write(
+                case.write(
                     GetData(plcVal, PLC_NAME, plc_tag),
                     CONDITIONAL(command == 'QtyF.Play' and value == 'Per',
                         [plcVal.set(plcVal & (req < maxReq))]),
                     SetData(plcVal, HMI_NAME, hmi_tag),
                 )
-            m.write(EMPTY())
+            case.write(EMPTY())
 
 
         # Read float values
@@ -175,12 +184,12 @@ def generate_update_tank_values():
             plc_tag = f"{tank}.QtyF.{plc_suffix}"
             hmi_tag = f"Tank{hmi_part}"
             if hmi_part in read_float_values:
-                m.write(
+                case.write(
                     GetData(plcFloat, PLC_NAME, plc_tag),
                     SetData(plcFloat, HMI_NAME, hmi_tag),
                 )
             elif hmi_part in write_float_values:
-                m.write(
+                case.write(
                     COMMENT('Read req value'),
                     GetData(loading, HMI_NAME, LOADING_FLAG_NAME),
                     IF(loading)(
@@ -188,19 +197,19 @@ def generate_update_tank_values():
                         SetData(plcFloat, HMI_NAME, hmi_tag),
                     ),
                 )
-        m.write(
+        case.write(
             COMMENT('Reset loading flag'),
             ASYNC_TRIG_MACRO('ResetLoadingFlag1S'),
-            RETURN(),
-            C_END_IF(),
         )
+    m.write(SWITCH(tankIndex, cases))
 
     m.end()
-    m.display()
-    m.clipboard()
+    eliminate_redundant_reads(m)
+    return m
 
 # Generate WriteCmd Script
-def generate_write_tank_values():
+@generator('write_tank')
+def generate_write_tank_values() -> Macro:
     m = Macro('WriteTankValues', 'Writes the modified values for the tank screen')
     
     m.begin()
@@ -208,19 +217,18 @@ def generate_write_tank_values():
     f = vbool('f', False)
     t = vbool('t', True)
     hmiVal = vbool('hmiVal')
-    tankSelected = vbool('tankSelected')
+    tankIndex = vshort('tankIndex')
+    cases = {}
     
-    for tank in tanks:
-        m.write(
-            COMMENT(f'{tank} Tank'),
-            GetData(tankSelected, HMI_NAME, tank),
-            C_IF(tankSelected),
-        )
+    m.write(GetData(tankIndex, HMI_NAME, TANK_INDEX_NAME))
+    for i, tank in enumerate(tanks):
+        case = cases[i] = BLOCK()
+        case.write(COMMENT(f'{tank} Tank'))
         for command in tank_commands:
             for value in write_values:
                 plc_tag = f"{tank}.{command}.{value}"
                 hmi_tag = f"Tank{strip_dot(command)}{value}"
-                m.write(
+                case.write(
                     GetData(hmiVal, HMI_NAME, hmi_tag),
                     IF(hmiVal)(
                         SetData(t, PLC_NAME, plc_tag),
@@ -234,19 +242,14 @@ def generate_write_tank_values():
                 continue
             plc_tag = f"{tank}.QtyF.{plc_part}"
             hmi_tag = f"Tank{hmi_part}"
-            m.write(
+            case.write(
                 GetData(hmiFloat, HMI_NAME, hmi_tag),
                 SetData(hmiFloat, PLC_NAME, plc_tag),
             )
-        m.write(
-            RETURN(),
-            C_END_IF(),
-            EMPTY(),
-        )
+    m.write(SWITCH(tankIndex, cases))
         
     m.end()
-    m.display()
-    m.clipboard()
+    return m
 
 # Define hopper names and commands
 hoppers = ["H41", "H42", "H43", "H44"]
@@ -258,7 +261,8 @@ hopper_feed_counts = {
 }
 
 # Generate LoadHopperValues Script
-def generate_load_hopper_values():
+@generator('load_hopper')
+def generate_load_hopper_values() -> Macro:
     m = Macro('LoadHopperValues', 'Resets all the values for the hopper screen')
 
     m.begin()
@@ -301,11 +305,11 @@ def generate_load_hopper_values():
         m.write(EMPTY())
         
     m.end()
-    m.display()
-    m.clipboard()
+    return m
 
 # Generate UpdateHopperOnPer Script
-def generate_update_hopper_values():
+@generator('update_hopper')
+def generate_update_hopper_values() -> Macro:
     m = Macro('UpdateHopperValues', 'Updates the values for the hopper screen')
     
     m.begin()
@@ -423,11 +427,14 @@ def generate_update_hopper_values():
         )
 
     m.end()
-    m.display()
-    m.clipboard()
+    simplify_expressions(m)
+    eliminate_redundant_reads(m)
+    coalesce_reads(m)
+    return m
 
 # Generate WriteHopperReq Script
-def generate_write_hopper_values():
+@generator('write_hopper')
+def generate_write_hopper_values() -> Macro:
     m = Macro('SendHopperValues', 'Writes the modified values for the hopper screen')
     
     m.begin()
@@ -493,8 +500,7 @@ def generate_write_hopper_values():
             EMPTY(),
         )
     m.end()
-    m.display()
-    m.clipboard()
+    return m
 
 valves = [
     'V80100',
@@ -571,7 +577,8 @@ valve_other_values = {
     
 }
 
-def load_valve_values():
+@generator('load_valve')
+def load_valve_values() -> Macro:
     m = Macro('LoadValveValues', 'Resets all the values for the valve screen')
     
     m.begin()
@@ -590,10 +597,10 @@ def load_valve_values():
     #     m.write(SetData(f, HMI_NAME, hmi_tag))
     
     m.end()
-    m.display()
-    m.clipboard()
+    return m
     
-def read_valve_values():
+@generator('read_valve')
+def read_valve_values() -> Macro:
     m = Macro('UpdateValveValues', 'Reads the values for the valve screen')
     
     m.begin()
@@ -601,31 +608,29 @@ def read_valve_values():
     plcVal = vbool('plcVal')
     f = vbool('f', False)
     t = vbool('t', True)
-    valveSelected = vbool('valveSelected')
+    valveIndex = vshort('valveIndex')
+    cases = {}
     
-    for valve in valves:
-        m.write(
-            COMMENT(f'{valve} Valve'),
-            GetData(valveSelected, HMI_NAME, valve),
-            C_IF(valveSelected),
-        )
+    m.write(GetData(valveIndex, HMI_NAME, VALVE_INDEX_NAME))
+    for i, valve in enumerate(valves):
+        case = cases[i] = BLOCK()
+        case.write(COMMENT(f'{valve} Valve'))
         for hmi_tag, plc_suffix in valve_read_values.items():
-            m.write(
+            case.write(
                 GetData(plcVal, PLC_NAME, f'{valve}.{plc_suffix}'),
                 SetData(plcVal, HMI_NAME, hmi_tag),
             )
-        m.write(
+        case.write(
             COMMENT('Reset loading flag'),
             ASYNC_TRIG_MACRO('ResetLoadingFlag0S'),
-            RETURN(),
-            C_END_IF(),
-            EMPTY(),
         )
+    m.write(SWITCH(valveIndex, cases))
     m.end()
-    m.display()
-    m.clipboard()
+    coalesce_reads(m)
+    return m
 
-def send_valve_values():
+@generator('send_valve')
+def send_valve_values() -> Macro:
     m = Macro('SendValveValues', 'Writes the modified values for the valve screen')
     
     m.begin()
@@ -633,29 +638,22 @@ def send_valve_values():
     hmiVal = vbool('hmiVal')
     f = vbool('f', False)
     t = vbool('t', True)
-    valveSelected = vbool('valveSelected')
+    valveIndex = vshort('valveIndex')
+    cases = {}
     
-    for valve in valves:
-        m.write(
-            COMMENT(f'{valve} Valve'),
-            GetData(valveSelected, HMI_NAME, valve),
-            C_IF(valveSelected),
-        )
-        
+    m.write(GetData(valveIndex, HMI_NAME, VALVE_INDEX_NAME))
+    for i, valve in enumerate(valves):
+        case = cases[i] = BLOCK()
+        case.write(COMMENT(f'{valve} Valve'))
         for hmi_tag, plc_suffix in valve_write_values.items():
-            m.write(
+            case.write(
                 GetData(hmiVal, HMI_NAME, hmi_tag),
                 SetData(hmiVal, PLC_NAME, f'{valve}.{plc_suffix}'),
                 SetData(f, HMI_NAME, hmi_tag),
             )
-        m.write(
-            RETURN(),
-            C_END_IF(),
-            EMPTY(),
-        )
+    m.write(SWITCH(valveIndex, cases))
     m.end()
-    m.display()
-    m.clipboard()
+    return m
 
 def generate_tank_lock_load():
     print(header)
@@ -696,8 +694,24 @@ def generate_tank_lock_write():
     script += "\nend macro_command\n\n"
     print(script)
 
-def reset_values(vars:list):
-    m = Macro('ResetValues', 'Resets the selection flags for the screen')
+@generator('reset_valve', VALVE_INDEX_NAME, 'ResetValveValues')
+@generator('reset_tank', TANK_INDEX_NAME, 'ResetTankValues')
+def reset_index(index:str, name:str) -> Macro:
+    m = Macro(name, 'Clears the selection of the screen')
+    
+    m.begin()
+    
+    noSelection = vshort('noSelection', NO_SELECTION)
+    
+    m.write(SetData(noSelection, HMI_NAME, index))
+    
+    m.end()
+    return m
+
+# The hopper screen still selects through one flag per hopper
+@generator('reset_hopper', hoppers, 'ResetHopperValues')
+def reset_values(vars:list, name:str = 'ResetValues') -> Macro:
+    m = Macro(name, 'Resets the selection flags for the screen')
     
     m.begin()
     
@@ -708,8 +722,7 @@ def reset_values(vars:list):
     )
     
     m.end()
-    m.display()
-    m.clipboard()
+    return m
 
 TANK_VALVES_MAP = {
     'C21' : 'V80121',
@@ -728,6 +741,28 @@ TANK_VALVES_MAP = {
 }
 
 
+HOPPER_CONNECTIONS = {
+    'H41' : {
+        'OL109' : ('V40141', 'VP40100'),
+        'OL002' : ('V40241', 'VP40200'),
+        'OL054' : ('V43041', 'VP43000'),
+    },
+    'H42' : {
+        'OL056' : ('V41042', 'VP41000'),
+        'OL110' : ('V41242', 'VP41200'),
+        'OL016' : ('V41342', 'VP41300'),
+        'OL020' : ('V42142', 'VP42100'),
+    },
+    'H43' : {
+        'OL041' : ('V40443', 'VP40400'),
+        'OL050' : ('V41143', 'VP41100'),
+    },
+    'H44' : {
+        'OL013' : ('V40344', 'VP40300'),
+    },
+}
+
+
 def generate_tank_consts():
     
     print(header)
@@ -736,7 +771,8 @@ def generate_tank_consts():
         script += f'short G_{t} = {i}'
     print(script)
 
-def generate_sim_tank(part:int):
+@generator('sim_tank')
+def generate_sim_tank(max_size:int = MACRO_MAX_SIZE) -> List[Macro]:
     m = Macro('SimTank', 'Simulates the behavior of a tank')
     
     m.begin()
@@ -840,41 +876,40 @@ def generate_sim_tank(part:int):
         for a in write_values:
             write_commands_map[f'{cmd}.{a}'] = eval(f'{trunc_cmd}{a}')
     
-    m.write(
-        GetData(id, HMI_NAME, 'SIM_id'),
-        EMPTY(),
-    )
+    readId = GetData(id, HMI_NAME, 'SIM_id')
+    m.write(readId)
     
-    for i, tank in enumerate(tanks[:7] if part == 0 else tanks[7:]):
-        m.write(
+    cases = {}
+    for i, tank in enumerate(tanks):
+        case = cases[i] = BLOCK()
+        case.write(
             COMMENT(tank),
-            C_IF(id == i),
             COMMENT('Read values'),
         )
         
         for plc_suffix, var in all_values_map.items():
-            m.write(
+            case.write(
                 GetData(var, PLC_NAME, f'{tank}.{plc_suffix}')
             )
         
-        m.write(EMPTY())
+        case.write(EMPTY())
         
         for plc_suffix, var in float_map.items():
-            m.write(
+            case.write(
                 GetData(var, PLC_NAME, f'{tank}.{plc_suffix}'),
             )
         
-        m.write(EMPTY())
+        case.write(EMPTY())
         for plc_suffix, var in F0_map.items():
-            m.write(
+            case.write(
                 GetData(var, PLC_NAME, f'Program:{tank[:2]}x.{tank}_F0.{plc_suffix}')
             )
             
-        m.write(EMPTY())
+        case.write(EMPTY())
         for index, timer in { '0':F0_Traz, '1':F0_Tcorr}.items():
-            m.write(*timer.GetData(f'{tank}.T.{index}'))
+            case.write(*timer.GetData(f'{tank}.T.{index}'))
         
-        m.write(
+        case.write(
             EMPTY(),
             COMMENT('Tank behavior'),
             EMPTY(),
@@ -965,40 +1000,42 @@ def generate_sim_tank(part:int):
             ).ELSE()( Alarm10.set(False) ),
         )
         
-        m.write(
+        case.write(
             EMPTY(),
             COMMENT('Write values'),
         )
         
         for plc_suffix, var in all_values_map.items():
-            m.write(
+            case.write(
                 SetData(var, PLC_NAME, f'{tank}.{plc_suffix}')
             )
         
-        m.write(EMPTY())
+        case.write(EMPTY())
         
         for plc_suffix, var in float_map.items():
-            m.write(
+            case.write(
                 SetData(var, PLC_NAME, f'{tank}.{plc_suffix}'),
             )
         
         for plc_suffix, var in mirror_map.items():
-            m.write(
+            case.write(
                 SetData(var, PLC_NAME, f'{tank}.{plc_suffix}'),
             )
             
-        m.write(EMPTY())
+        case.write(EMPTY())
         for index, timer in { '0':F0_Traz, '1':F0_Tcorr}.items():
-            m.write(*timer.SetData(f'{tank}.T.{index}'))
+            case.write(*timer.SetData(f'{tank}.T.{index}'))
             
-        m.write(
-            C_END_IF(),
-            EMPTY(),
-        )
+        case.write(EMPTY())
+    m.write(SWITCH(id, cases))
     
     m.end()
-    m.display()
-    m.clipboard()
+    parts = m.partition(max_size, [readId])
+    for part in parts:
+        simplify_expressions(part)
+        eliminate_common_subexpressions(part)
+        eliminate_dead_writes(part)
+    return parts
         
         
 def generate_sim_tank_valves():
@@ -1051,6 +1088,7 @@ def test_simple_macro():
     return m
 
 def generate_js_valves():
+    import pyperclip
     s = ''
     ff = decodebytes(b'AAABIwBSb2Nrd2VsbCBFdGhlck5ldC9JUCAoQ29tcGFjdExvZ2l4KcQLAFZQNDAxMDAuSE1JAAAAAAACAQA=')
     print(ff)
@@ -1060,31 +1098,4 @@ def generate_js_valves():
     pyperclip.copy(s)
     
 if __name__ == "__main__":
-    # Output the scripts
-    sleep(1)
-    print()
-    print()
-    
-    # TODO Add W11, W12 and M50
-    # generate_load_tank_values()
-    # generate_update_tank_values()
-    # generate_write_tank_values()
-    # reset_values(tanks)
-
-    # Output the new scripts for hoppers
-    # generate_load_hopper_values()
-    generate_update_hopper_values()
-    # generate_write_hopper_values()
-    # reset_values(hoppers)
-
-    # load_valve_values()
-    # read_valve_values()
-    # send_valve_values()
-    # reset_values(valves)
-    
-    # generate_sim_tank(0)
-    # input()
-    # generate_sim_tank(1)
-    # test_simple_macro().display()
-    
-    # generate_js_valves()    
+    main()
@@ -0,0 +1,570 @@
+from __future__ import annotations
+import itertools
+import re
+from typing import Any, Callable, Dict, FrozenSet, Iterator, List, Optional, Set, Tuple, Union
+
+from api import *
+
+
+# Statements that split a block into straight-line segments
+MARKERS = (C_IF, C_ELIF, C_ELSE, C_END_IF, BEGIN_MACRO, END_MACRO, RETURN, BREAK, CONTINUE, CONDITIONAL)
+
+READS = ('GetData', 'GetDataEx')
+WRITES = ('SetData', 'SetDataEx')
+
+
+def walk_blocks(statements:List[STATEMENT]) -> Iterator[Tuple[int, List[STATEMENT]]]:
+    """Yields (depth, block) for the given statement list and every nested one, outermost first."""
+    seen = set()
+    stack = [(0, statements)]
+    while stack:
+        depth, block = stack.pop()
+        if id(block) in seen:
+            continue
+        seen.add(id(block))
+        yield depth, block
+        for s in reversed(block):
+            stack.extend((depth + 1, b) for b in reversed(s.blocks()))
+            
+def walk_statements(statement:STATEMENT) -> Iterator[STATEMENT]:
+    """Yields the statement and every statement nested in it."""
+    yield statement
+    for block in statement.blocks():
+        for s in block:
+            yield from walk_statements(s)
+
+def segments(block:List[STATEMENT]) -> Iterator[Tuple[int, int]]:
+    """Yields the (start, end) ranges of the straight-line runs of a block."""
+    start = 0
+    for i, s in enumerate(block):
+        if isinstance(s, MARKERS):
+            if i > start:
+                yield start, i
+            start = i + 1
+    if len(block) > start:
+        yield start, len(block)
+
+def is_call(statement:STATEMENT, *names:str) -> bool:
+    return isinstance(statement, CALL) and statement.funcName in names
+
+def transfer(statement:STATEMENT) -> Optional[Tuple[Variable, str, str, int]]:
+    """Returns (variable, device, address, count) of a GetData/SetData call."""
+    if not is_call(statement, *READS, *WRITES) or len(statement.params) != 4:
+        return None
+    var, device, address, count = statement.params
+    if not isinstance(var, Variable) or isinstance(var, Array):
+        return None
+    return var, device, address, count
+
+
+ADDRESS = re.compile(r'^(.*?)([.\[])(\d+)(\]?)$')
+
+def coalesce_reads(macro:Macro, max_gap:int = 0) -> Macro:
+    """Merges single reads of consecutive addresses into one array read.
+    
+    Within a straight-line segment, GetData calls to the same device whose
+    addresses only differ by a trailing index (``C21.Alarms.11``, ``C21.Alarms.12``
+    or ``Tag[0]``, ``Tag[1]``) are replaced by a single GetData into a generated
+    array at the position of the first read. Each original read becomes an
+    assignment from that array so the variables keep their values at the same
+    point. A write to one of the addresses, or a DELAY or macro trigger
+    anywhere, stops the merge at that point.
+    
+    ``max_gap`` allows that many unused addresses between two merged reads.
+    """
+    # An array lives inside one segment, so every segment can reuse the arrays of the others.
+    # Only an array read before a nested block and used after it is kept for itself.
+    pool = TemporaryPool(macro, 'reads')
+    for _, block in list(walk_blocks(macro.statements)):
+        replacements:Dict[int, List[STATEMENT]] = {}
+        for start, end in segments(block):
+            pool.release()
+            pending:Dict[Tuple, List[Tuple[int, Variable, int]]] = {}
+            for i in range(start, end):
+                s = block[i]
+                t = transfer(s)
+                if t is not None and is_call(s, 'GetData') and t[3] == 1:
+                    var, device, address, _ = t
+                    m = ADDRESS.match(address)
+                    if m is not None:
+                        prefix, opening, index, closing = m.groups()
+                        key = (device, prefix, opening, closing, var.dtype)
+                        pending.setdefault(key, []).append((i, var, int(index)))
+                        continue
+                # A delay or another macro can change the PLC values, later reads must not move before it
+                if any(is_call(ss, *BARRIERS) for ss in walk_statements(s)):
+                    for key in list(pending):
+                        _merge(pool, block, key, pending.pop(key), max_gap, replacements)
+                    continue
+                for key in [k for k in pending if _writes_to(s, k[0], k[1])]:
+                    _merge(pool, block, key, pending.pop(key), max_gap, replacements)
+            for key, reads in pending.items():
+                _merge(pool, block, key, reads, max_gap, replacements)
+        if replacements:
+            block[:] = [r for i, s in enumerate(block) for r in replacements.get(i, [s])]
+    macro.invalidate()
+    return macro
+
+def _writes_to(statement:STATEMENT, device:str, prefix:str) -> bool:
+    for s in walk_statements(statement):
+        t = transfer(s)
+        if t is not None and is_call(s, *WRITES) and t[1] == device and t[2].startswith(prefix):
+            return True
+    return False
+
+class TemporaryPool:
+    """Hands out generated variables or arrays, reusing the ones released by an earlier segment."""
+    def __init__(self, macro:Macro, prefix:str):
+        self.macro = macro
+        self.prefix = prefix
+        self._variables:Dict[Tuple[str, Optional[int]], List[Variable]] = {}
+        self._used:Dict[Tuple[str, Optional[int]], int] = {}
+        # The first variables of each list are kept, release() never hands them out again
+        self._kept:Dict[Tuple[str, Optional[int]], int] = {}
+        
+    def get(self, dtype:dt, size:int = None, keep:bool = False) -> Variable:
+        key = (dtype, size)
+        variables = self._variables.setdefault(key, [])
+        kept = self._kept.get(key, 0)
+        used = self._used.get(key, kept)
+        if used == len(variables):
+            variables.append(self.macro.temporary(self.prefix, dtype, size))
+        self._used[key] = used + 1
+        if keep:
+            variables[kept], variables[used] = variables[used], variables[kept]
+            self._kept[key] = kept + 1
+            return variables[kept]
+        return variables[used]
+    
+    def release(self):
+        self._used = dict(self._kept)
+
+def _merge(pool:TemporaryPool, block:List[STATEMENT], key:Tuple, reads:List[Tuple[int, Variable, int]], 
+           max_gap:int, replacements:Dict[int, List[STATEMENT]]):
+    device, prefix, opening, closing, dtype = key
+    runs:List[List[Tuple[int, Variable, int]]] = []
+    for read in sorted(reads, key=lambda r: (r[2], r[0])):
+        if len(runs) > 0 and read[2] - runs[-1][-1][2] <= max_gap + 1:
+            runs[-1].append(read)
+        else:
+            runs.append([read])
+    for run in runs:
+        first, last = run[0][2], run[-1][2]
+        if first == last:
+            continue
+        position = min(r[0] for r in run)
+        # Nested blocks reuse the released arrays, one still needed after them can't be shared
+        nested = any(len(block[i].blocks()) > 0 for i in range(position, max(r[0] for r in run)))
+        arr = pool.get(dtype, last - first + 1, keep=nested)
+        address = f'{prefix}{opening}{first}{closing}'
+        replacements[position] = [GetData(arr[0], device, address, last - first + 1)]
+        for i, var, index in sorted(run):
+            replacements.setdefault(i, []).append(var.set(arr[index - first]))
+
+
+# Calls that let time pass or run other macros, after which no tag value is trusted
+BARRIERS = ('DELAY', 'ASYNC_TRIG_MACRO', 'SYNC_TRIG_MACRO')
+
+Facts = Dict[str, Tuple[str, str]]
+
+class _Frame:
+    def __init__(self, entry:Optional[Facts]):
+        self.entry = entry
+        self.exits:List[Optional[Facts]] = []
+        self.has_else = False
+
+def _merge_facts(states:List[Optional[Facts]]) -> Optional[Facts]:
+    reachable = [s for s in states if s is not None]
+    if len(reachable) == 0:
+        return None
+    first, *others = reachable
+    return {k: v for k, v in first.items() if all(o.get(k) == v for o in others)}
+
+def _overlaps(a:str, b:str) -> bool:
+    return a == b or a.startswith(b + '.') or b.startswith(a + '.')
+
+class _TransferEliminator:
+    def __init__(self, reads:bool, writes:bool):
+        self.reads = reads
+        self.writes = writes
+        self.variables:Dict[str, Variable] = {}
+        
+    def block(self, block:List[STATEMENT], state:Optional[Facts]) -> Optional[Facts]:
+        frames:List[_Frame] = []
+        result:List[STATEMENT] = []
+        for s in block:
+            keep, state = self.statement(s, state, frames)
+            result.extend(keep)
+        # Containers close their last if when baked, not in their content
+        while frames:
+            state = self._end_if(frames.pop(), state)
+        block[:] = result
+        return state
+    
+    def _end_if(self, frame:_Frame, state:Optional[Facts]) -> Optional[Facts]:
+        exits = [*frame.exits, state]
+        if not frame.has_else:
+            exits.append(frame.entry)
+        return _merge_facts(exits)
+        
+    def statement(self, s:STATEMENT, state:Optional[Facts], frames:List[_Frame]) -> Tuple[List[STATEMENT], Optional[Facts]]:
+        if isinstance(s, C_IF):
+            frames.append(_Frame(state))
+            return [s], None if state is None else dict(state)
+        if isinstance(s, (C_ELIF, C_ELSE)) and frames:
+            frame = frames[-1]
+            frame.exits.append(state)
+            frame.has_else = isinstance(s, C_ELSE)
+            return [s], None if frame.entry is None else dict(frame.entry)
+        if isinstance(s, C_END_IF) and frames:
+            return [s], self._end_if(frames.pop(), state)
+        if isinstance(s, (RETURN, BREAK, CONTINUE)):
+            return [s], None
+        if isinstance(s, CONDITIONAL):
+            chosen = s.onTrue if s.result else s.onFalse
+            return [s], state if chosen is None else self.block(chosen, state)
+        if len(s.blocks()) > 0:
+            for b in s.blocks():
+                state = self.block(b, state)
+            return [s], state
+        if state is None:
+            return [s], state
+        if isinstance(s, ASSIGNEMENT):
+            return [s], self._kill_var(state, s.var)
+        if isinstance(s, CALL):
+            return self.call(s, state)
+        return [s], state
+    
+    def _kill_var(self, state:Facts, var:Any) -> Facts:
+        if isinstance(var, Variable):
+            state.pop(var.name, None)
+        return state
+    
+    def _learn(self, state:Facts, var:Variable, fact:Tuple[str, str]):
+        self.variables[var.name] = var
+        state[var.name] = fact
+    
+    def call(self, s:CALL, state:Facts) -> Tuple[List[STATEMENT], Facts]:
+        if s.funcName in BARRIERS:
+            return [s], {}
+        t = transfer(s)
+        if t is None:
+            if is_call(s, *WRITES) and len(s.params) >= 2:
+                device = s.params[1]
+                return [s], {k: v for k, v in state.items() if v[0] != device}
+            for p in s.params:
+                self._kill_var(state, p)
+            return [s], state
+        var, device, address, count = t
+        if is_call(s, *WRITES):
+            if self.writes and is_call(s, 'SetData') and count == 1 and state.get(var.name) == (device, address):
+                return [], state
+            for k, v in list(state.items()):
+                if v[0] == device and _overlaps(v[1], address):
+                    state.pop(k)
+            if count == 1:
+                self._learn(state, var, (device, address))
+            return [s], state
+        fact = (device, address)
+        if not is_call(s, 'GetData') or count != 1:
+            return [s], self._kill_var(state, var)
+        if self.reads and state.get(var.name) == fact:
+            return [], state
+        self._kill_var(state, var)
+        holders = [self.variables[k] for k, v in state.items() if v == fact and self.variables[k].dtype == var.dtype]
+        self._learn(state, var, fact)
+        if not self.reads or len(holders) == 0:
+            return [s], state
+        return [var.set(holders[0])], state
+
+def eliminate_redundant_reads(macro:Macro) -> Macro:
+    """Removes GetData calls whose value is already held by a variable.
+    
+    The pass follows each path through the macro and records which variable
+    holds which tag after a GetData or SetData. A later single read of the same
+    tag is replaced by a copy from that variable, as long as no write to the tag,
+    no reassignment of the variable, no DELAY and no macro trigger happened on
+    every path leading to it. if/else if/else markers and containers are merged
+    at their end, and code after a return is not considered reachable.
+    """
+    _TransferEliminator(reads=True, writes=False).block(macro.statements, {})
+    macro.invalidate()
+    return macro
+
+def eliminate_dead_writes(macro:Macro) -> Macro:
+    """Removes SetData calls that write back a value the tag already has.
+    
+    Uses the same path analysis as eliminate_redundant_reads: a SetData of a
+    variable to the tag it was read from (or last written to) is dropped when the
+    variable was not reassigned on any path since. Write-backs of variables that
+    may have changed on at least one path are kept.
+    """
+    _TransferEliminator(reads=False, writes=True).block(macro.statements, {})
+    macro.invalidate()
+    return macro
+
+
+TRUE = LITERAL('true')
+FALSE = LITERAL('false')
+
+NEGATED = {'==': '<>', '<>': '==', '<': '>=', '>=': '<', '>': '<=', '<=': '>'}
+COMPARISONS:Dict[str, Callable[[Any, Any], bool]] = {
+    '==': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+def constant(value:Any) -> Optional[Union[bool, int, float]]:
+    """Returns the python value of a literal operand, or None if it is not constant."""
+    if isinstance(value, (bool, int, float)):
+        return value
+    if not isinstance(value, LITERAL):
+        return None
+    text = value.literal.strip()
+    if text.lower() in ('true', 'false'):
+        return text.lower() == 'true'
+    for parse in (int, float):
+        try:
+            return parse(text)
+        except ValueError:
+            pass
+    return None
+
+def boolean(value:bool) -> LITERAL:
+    return TRUE if value else FALSE
+
+def simplify(expression:Any) -> Any:
+    """Returns an equivalent expression with constants folded.
+    
+    Nested AND/OR are flattened, double negations cancel, comparisons between
+    constants are evaluated, a negated comparison becomes the opposite
+    comparison and duplicate terms of an AND/OR are dropped. A term and its
+    negation in the same AND/OR fold to false/true. Anything that is not an
+    expression is returned as is.
+    """
+    if isinstance(expression, NOT):
+        inner = simplify(expression.expression)
+        value = constant(inner)
+        if isinstance(value, bool):
+            return boolean(not value)
+        if isinstance(inner, NOT):
+            return inner.expression
+        if isinstance(inner, COMPARE):
+            return COMPARE(inner.left, NEGATED[inner.operator], inner.right)
+        return NOT(inner)
+    if isinstance(expression, (AND, OR)):
+        return _simplify_terms(expression)
+    if isinstance(expression, COMPARE):
+        left, right = simplify(expression.left), simplify(expression.right)
+        a, b = constant(left), constant(right)
+        if a is not None and b is not None:
+            return boolean(COMPARISONS[expression.operator](a, b))
+        return COMPARE(left, expression.operator, right)
+    return expression
+
+def _simplify_terms(expression:Union[AND, OR]) -> EXPRESSION:
+    kind = type(expression)
+    # The value that decides the whole expression: false for AND, true for OR
+    absorbing = kind is OR
+    terms:Dict[str, EXPRESSION] = {}
+    stack = list(reversed(expression._expressions))
+    while stack:
+        term = simplify(stack.pop())
+        if isinstance(term, kind):
+            stack.extend(reversed(term._expressions))
+            continue
+        value = constant(term)
+        if isinstance(value, bool):
+            if value == absorbing:
+                return boolean(absorbing)
+            continue
+        terms.setdefault(str(term), term)
+    for term in terms.values():
+        if isinstance(term, NOT) and str(term.expression) in terms:
+            return boolean(absorbing)
+    if len(terms) == 0:
+        return boolean(not absorbing)
+    if len(terms) == 1:
+        return next(iter(terms.values()))
+    return kind(*terms.values())
+
+def simplify_expressions(macro:Macro) -> Macro:
+    """Simplifies every condition, assigned value and returned value of the macro.
+    
+    See simplify for the rewrites applied.
+    """
+    for _, block in walk_blocks(macro.statements):
+        for s in block:
+            if isinstance(s, (C_IF, C_ELIF)):
+                s.condition = simplify(s.condition)
+            elif isinstance(s, ASSIGNEMENT) and isinstance(s.value, EXPRESSION):
+                s.value = simplify(s.value)
+            elif isinstance(s, RETURN) and isinstance(s.ret, EXPRESSION):
+                s.ret = simplify(s.ret)
+    macro.invalidate()
+    return macro
+
+
+def operands(expression:Any) -> Set[str]:
+    """Returns the names of the variables and tags an expression reads."""
+    names:Set[str] = set()
+    stack = [expression]
+    while stack:
+        e = stack.pop()
+        if isinstance(e, Variable):
+            names.add(e.name)
+        elif isinstance(e, LITERAL) and len(e.resources) == 0 and constant(e) is None:
+            names.add(e.literal)
+        if isinstance(e, Resource):
+            stack.extend(e.resources)
+    return names
+
+def written(statement:STATEMENT) -> Set[str]:
+    """Returns the names of the variables a statement may assign."""
+    names:Set[str] = set()
+    for s in walk_statements(statement):
+        if isinstance(s, ASSIGNEMENT):
+            names |= operands(s.var)
+        elif isinstance(s, CALL) and s.funcName not in WRITES:
+            for p in s.params:
+                names |= operands(p)
+    return names
+
+class _Site:
+    """A slot holding an expression: an attribute of a statement or a term of an AND/OR/NOT."""
+    def __init__(self, owner:Any, key:Union[str, int], depth:int = 0):
+        self.owner = owner
+        self.key = key
+        self.depth = depth
+        
+    def get(self) -> Any:
+        if isinstance(self.key, int):
+            return self.owner._expressions[self.key]
+        return getattr(self.owner, self.key)
+    
+    def set(self, value:Any):
+        if isinstance(self.key, int):
+            self.owner._expressions[self.key] = value
+            self.owner.resources = tuple(self.owner._expressions)
+            return
+        setattr(self.owner, self.key, value)
+        if isinstance(self.owner, NOT):
+            self.owner.resources = (value,)
+
+def _copy(expression:Any) -> Any:
+    # Expression objects may be shared between statements, so terms are only replaced in copies
+    if isinstance(expression, (AND, OR)):
+        return type(expression)(*[_copy(e) for e in expression._expressions])
+    if isinstance(expression, NOT):
+        return NOT(_copy(expression.expression))
+    return expression
+
+class _Available:
+    def __init__(self, expression:Union[AND, OR], terms:FrozenSet[str], index:int, path:Tuple[int, ...], site:_Site):
+        self.expression = expression
+        self.terms = terms
+        self.operands = operands(expression)
+        self.index = index
+        self.path = path
+        self.site = site
+        self.holder:Optional[Variable] = None
+
+class _CommonSubexpressions:
+    def __init__(self, pool:TemporaryPool):
+        self.pool = pool
+        
+    def block(self, block:List[STATEMENT]):
+        self.pool.release()
+        self.available:List[_Available] = []
+        self.insertions:Dict[int, List[Tuple[int, STATEMENT]]] = {}
+        branches = itertools.count()
+        path:Tuple[int, ...] = ()
+        for i, s in enumerate(block):
+            if isinstance(s, C_IF):
+                self.visit(_Site(s, 'condition'), i, path)
+                path = (*path, next(branches))
+            elif isinstance(s, (C_ELIF, C_ELSE)) and path:
+                path = (*path[:-1], next(branches))
+            elif isinstance(s, C_END_IF) and path:
+                path = path[:-1]
+            else:
+                self.statement(s, i, path)
+        if self.insertions:
+            result:List[STATEMENT] = []
+            for i, s in enumerate(block):
+                # Temporaries of nested terms are computed before the ones using them
+                for _, hoisted in sorted(self.insertions.get(i, []), key=lambda h: -h[0]):
+                    result.append(hoisted)
+                result.append(s)
+            block[:] = result
+                
+    def statement(self, s:STATEMENT, i:int, path:Tuple[int, ...]):
+        root = None
+        if isinstance(s, ASSIGNEMENT):
+            root = self.visit(_Site(s, 'value'), i, path)
+        elif isinstance(s, RETURN):
+            self.visit(_Site(s, 'ret'), i, path)
+        elif isinstance(s, (CONDITION_BLOCK, COMPLETED_CONTAINER)):
+            first = s.blocks()[0]
+            if len(first) > 0 and isinstance(first[0], C_IF):
+                self.visit(_Site(first[0], 'condition'), i, path)
+        names = written(s)
+        if names:
+            self.available = [a for a in self.available if not (a.operands & names 
+                              or (a.holder is not None and a.holder.name in names))]
+        # The assigned variable already holds the value, no temporary is needed for it
+        if root is not None and root in self.available and s.var.dtype == 'bool':
+            root.holder = s.var
+            
+    def visit(self, site:_Site, i:int, path:Tuple[int, ...]) -> Optional[_Available]:
+        expression = site.get()
+        if site.depth == 0 and isinstance(expression, (AND, OR, NOT)):
+            expression = _copy(expression)
+            site.set(expression)
+        if isinstance(expression, NOT):
+            self.visit(_Site(expression, 'expression', site.depth + 1), i, path)
+            return None
+        if not isinstance(expression, (AND, OR)):
+            return None
+        terms = frozenset(str(e) for e in expression._expressions)
+        matches = [a for a in self.available if type(a.expression) is type(expression) 
+                   and a.terms <= terms and path[:len(a.path)] == a.path]
+        if matches:
+            match = max(matches, key=lambda a: len(a.terms))
+            holder = match.holder or self.hoist(match)
+            rest = [e for e in expression._expressions if str(e) not in match.terms]
+            site.set(type(expression)(holder, *rest) if rest else holder.as_literal())
+            return None
+        available = _Available(expression, terms, i, path, site)
+        self.available.append(available)
+        for k in range(len(expression._expressions)):
+            self.visit(_Site(expression, k, site.depth + 1), i, path)
+        return available
+    
+    def hoist(self, available:_Available) -> Variable:
+        holder = self.pool.get('bool')
+        self.insertions.setdefault(available.index, []).append((available.site.depth, holder.set(available.expression)))
+        available.site.set(holder.as_literal())
+        available.holder = holder
+        return holder
+
+def eliminate_common_subexpressions(macro:Macro, prefix:str = 'cse') -> Macro:
+    """Evaluates repeated AND/OR expressions only once.
+    
+    Within a statement list, an AND/OR that was already evaluated earlier on
+    every path to it, with none of its operands assigned in between, is replaced
+    by a variable holding its value. That is the variable it was assigned to if
+    there is one, otherwise a generated bool temporary computed right before
+    the first occurrence. An AND/OR with more terms that contains all the terms
+    of the earlier one reuses it for those terms. Conditions of if/else if
+    containers count as evaluated where the container is.
+    """
+    # Blocks at the same depth never overlap in time, so they can share temporaries
+    pools:Dict[int, TemporaryPool] = {}
+    for depth, block in list(walk_blocks(macro.statements)):
+        _CommonSubexpressions(pools.setdefault(depth, TemporaryPool(macro, prefix))).block(block)
+    macro.invalidate()
+    return macro
@@ -1,13 +1,18 @@
 from __future__ import annotations
 from abc import abstractmethod
+from collections import deque
 from enum import Enum, Flag
 import enum
 from functools import cache, cached_property
 import itertools
-from typing import Callable, Dict, Iterable, Literal, Optional, Set, Tuple, TypeVar, Union, List
-import pyperclip
-from pyvis.network import Network
-from api import AND, LITERAL, NOT, OR, EXPRESSION
+import sys
+import weakref
+from typing import TYPE_CHECKING, Callable, Dict, FrozenSet, Iterable, Iterator, Literal, Optional, Set, TextIO, Tuple, TypeVar, Union, List
+from api import AND, CALL, COMMENT, EMPTY, NOT, OR, EXPRESSION, STATEMENT, GetData, Macro, SetData, Variable, vbool, vfloat, vushort
+from optimize import eliminate_common_subexpressions, simplify, simplify_expressions
+
+if TYPE_CHECKING:
+    from pyvis.network import Network
 
 P = None
 
@@ -19,6 +24,8 @@ class Node:
         self.nodeType = nodeType
         self.id = Node.ID
         Node.ID += 1
+        # Graphs indexing this node, told about every attach and detach
+        self.graphs:weakref.WeakSet[Graph] = weakref.WeakSet()
         
     def attach(self, node:Node):
         if node is P:
@@ -27,12 +34,16 @@ class Node:
             return
         self.neighbors.add(node)
         node.neighbors.add(self)
+        for g in {*self.graphs, *node.graphs}:
+            g._attached(self, node)
         
     def detach(self, node:Node):
         if node not in self.neighbors:
             return
         self.neighbors.remove(node)
         node.neighbors.remove(self)
+        for g in {*self.graphs, *node.graphs}:
+            g._detached(self, node)
         
     def __gt__(self, node:Node) -> Node:
         if node is P:
@@ -103,6 +114,10 @@ class NodeType(Enum):
     HOPPER_INPUT = enum.auto()
     TANK = enum.auto()
     
+class Order(Enum):
+    BFS = enum.auto()
+    DFS = enum.auto()
+    
 class BranchType(Enum):
     UNKNOWN = enum.auto()
     DEO = enum.auto()
@@ -150,6 +165,11 @@ class Branch:
         
     def __hash__(self):
         return hash(f"{min(self.head.id, self.tail.id)}->{max(self.head.id, self.tail.id)}")
+    
+    @staticmethod
+    def between(n1:Node, n2:Node) -> Branch:
+        """The branch joining two nodes, its head being the node with the lowest id."""
+        return Branch(n1, n2) if n1.id < n2.id else Branch(n2, n1)
         
     @property
     def name(self) -> str:
@@ -165,6 +185,69 @@ class Branch:
 class Graph:
     def __init__(self, start:Node):
         self.start = start
+        self.branches:Set[Branch] = set()
+        self._nodes_by_id:Dict[int, Node] = {}
+        self._nodes_by_name:Dict[str, Node] = {}
+        self._branches_by_name:Dict[str, Branch] = {}
+        self._branches_by_ids:Dict[Tuple[int, int], Branch] = {}
+        self._explored:Dict[Tuple[Node, FrozenSet[Node], FrozenSet[NodeType], FrozenSet[NodeType]], Dict[Node, Set[Node]]] = {}
+        self._index()
+        
+    def _index(self):
+        for n in self._nodes_by_id.values():
+            n.graphs.discard(self)
+        self._nodes_by_id.clear()
+        self._nodes_by_name.clear()
+        self._branches_by_name.clear()
+        self._branches_by_ids.clear()
+        for n in self.elements():
+            self._add_node(n)
+        self.branches = self._find_branches()
+        for b in self.branches:
+            self._add_branch(b)
+        
+    def _add_node(self, node:Node):
+        self._nodes_by_id[node.id] = node
+        self._nodes_by_name.setdefault(node.name, node)
+        node.graphs.add(self)
+        
+    def _add_branch(self, branch:Branch):
+        key = (branch.head.id, branch.tail.id)
+        if key in self._branches_by_ids:
+            return
+        self.branches.add(branch)
+        self._branches_by_ids[key] = branch
+        self._branches_by_name.setdefault(branch.name, branch)
+        
+    def _attached(self, n1:Node, n2:Node):
+        if n1.id not in self._nodes_by_id:
+            n1, n2 = n2, n1
+        # Everything reachable from a new node joins the graph
+        stack = [n2]
+        while stack:
+            n = stack.pop()
+            if n.id in self._nodes_by_id:
+                continue
+            self._add_node(n)
+            for nn in n.neighbors:
+                self._add_branch(Branch.between(n, nn))
+                if nn.id not in self._nodes_by_id:
+                    stack.append(nn)
+        self._add_branch(Branch.between(n1, n2))
+        self._mutated()
+        
+    def _detached(self, n1:Node, n2:Node):
+        # Part of the graph may no longer be reachable from the start
+        self._index()
+        self._mutated()
+        
+    def _mutated(self):
+        self.__dict__.pop('net', None)
+        self._explored.clear()
+    
+    @cached_property
+    def net(self) -> Network:
+        from pyvis.network import Network
         options = """{
         "nodes": {
             "borderWidth": null,
@@ -195,7 +278,7 @@ class Graph:
             "minVelocity": 0.75
         }
         }"""
-        self.net = net = Network(notebook = True, cdn_resources = "remote",
+        net = Network(notebook = True, cdn_resources = "remote",
                 bgcolor = "#222222",
                 font_color = "white",
                 height = "750px",
@@ -205,7 +288,11 @@ class Graph:
         )
         # self.net.show_buttons()
         # self.net.set_options(options)
-        self.branches:Set[Branch] = self._find_branches()
+        for n in self.elements():
+            net.add_node(n.id, n.name, self.node2shape(n), )
+        for b in self.branches:
+            net.add_edge(b.head.id, b.tail.id, title=b.name)
+        return net
     
     def node2shape(self, node:Node) -> str:
         mapping = {
@@ -223,39 +310,34 @@ class Graph:
     def add_branch(self, branch:Branch):
         self.net.add_edge(branch.head.id, branch.tail.id, title=branch.name)
         
-    def _find_branches(self) -> Set[Branch]:
-        brs:Set[Branch] = set()
-        explored:Set[Node] = set()
-        discovered:Set[Node] = set()
-        discovered.add(self.start)
-        while len(discovered - explored) > 0:
-            s = discovered - explored
-            for n in s:
+    def traverse(self, start:Node = None, order:Order = Order.BFS) -> Iterator[Node]:
+        """Yields every node reachable from start (the graph's start by default) once."""
+        start = self.start if start is None else start
+        frontier:deque[Node] = deque([start])
+        if order is Order.DFS:
+            visited:Set[Node] = set()
+            while frontier:
+                n = frontier.pop()
+                if n in visited:
+                    continue
+                visited.add(n)
+                yield n
+                frontier.extend(nn for nn in n.neighbors if nn not in visited)
+        else:
+            visited = {start}
+            while frontier:
+                n = frontier.popleft()
+                yield n
                 for nn in n.neighbors:
-                    n1 = n if n.id < nn.id else nn
-                    n2 = n if n.id > nn.id else nn
-                    brs.add(Branch(n1, n2))
-                discovered.update(n.neighbors)
-                explored.add(n)
-                
-        for n in discovered:
-            self.add_node(n)
-
-        for b in brs:
-            self.add_branch(b)
+                    if nn not in visited:
+                        visited.add(nn)
+                        frontier.append(nn)
         
-        return brs
-    
-    def elements(self):
-        explored:Set[Node] = set()
-        discovered:Set[Node] = set()
-        discovered.add(self.start)
-        while len(discovered - explored) > 0:
-            s = discovered - explored
-            for n in s:
-                yield n
-                discovered.update(n.neighbors)
-                explored.add(n)
+    def _find_branches(self) -> Set[Branch]:
+        return {Branch.between(n, nn) for n in self.traverse() for nn in n.neighbors}
+    
+    def elements(self, order:Order = Order.BFS) -> Iterator[Node]:
+        return self.traverse(order=order)
         
     def print(self):
         for b in self.branches:
@@ -264,62 +346,50 @@ class Graph:
         self.net.show('graph.html')
     
     def with_id(self, id:int) -> Node:
-        explored:Set[Node] = set()
-        discovered:Set[Node] = set()
-        discovered.add(self.start)
-        while len(discovered - explored) > 0:
-            s = discovered - explored
-            for n in s:
-                if n.id == id:
-                    return n
-                discovered.update(n.neighbors)
-                explored.add(n)
+        return self._nodes_by_id.get(id)
     
     def branch_with_name(self, name:str) -> Optional[Branch]:
-        for b in self.branches:
-            if b.name == name:
-                return b
-        return None
+        return self._branches_by_name.get(name)
     
     def branch_with_nodes(self, n1:Node, n2:Node) -> Optional[Branch]:
-        b = Branch(n1, n2)
-        for bb in self.branches:
-            if b == bb:
-                return bb
-        return None
+        return self._branches_by_ids.get((min(n1.id, n2.id), max(n1.id, n2.id)))
     
     def with_name(self, name:str) -> Node:
-        explored:Set[Node] = set()
-        discovered:Set[Node] = set()
-        discovered.add(self.start)
-        while len(discovered - explored) > 0:
-            s = discovered - explored
-            for n in s:
-                if n.name == name:
-                    return n
-                discovered.update(n.neighbors)
-                explored.add(n)
+        return self._nodes_by_name.get(name)
                 
-    def explore(self, start: Node, ignoreNodes:Iterable[Node], ignoreTypes:Iterable[NodeType], goalTypes:Iterable[NodeType]):
-        branch_map:Dict[Node, Set[Node]] = dict()
+    def explore(self, start: Node, ignoreNodes:Iterable[Node], ignoreTypes:Iterable[NodeType], goalTypes:Iterable[NodeType]) -> Dict[Node, Set[Node]]:
+        """Maps every node reached from start, and start itself, to the goal nodes reachable through it.
         
-        def recur_explore(b_map:Dict[Node, Set[Node]], node:Node, explored:Set[Node]):
-            for n in node.neighbors.copy() - explored:
-                if n.nodeType in [*ignoreTypes]:
+        The search does not go through ignoreNodes, nodes of ignoreTypes nor
+        goal nodes. Results are cached until the graph changes; the sets are
+        shared between calls and must not be modified.
+        """
+        key = (start, frozenset(ignoreNodes), frozenset(ignoreTypes), frozenset(goalTypes))
+        if key not in self._explored:
+            self._explored[key] = self._explore(*key)
+        return dict(self._explored[key])
+    
+    def _explore(self, start:Node, ignoreNodes:FrozenSet[Node], ignoreTypes:FrozenSet[NodeType], goalTypes:FrozenSet[NodeType]) -> Dict[Node, Set[Node]]:
+        branch_map:Dict[Node, Set[Node]] = dict()
+        explored:Set[Node] = set(ignoreNodes)
+        # One frame per node being explored, with the neighbors it has left to look at
+        stack:List[Tuple[Node, Iterator[Node]]] = [(start, iter(start.neighbors - explored))]
+        while stack:
+            node, neighbors = stack[-1]
+            for n in neighbors:
+                if n.nodeType in ignoreTypes:
                     continue
-                if n.nodeType in [*goalTypes]:
-                    if node not in b_map.keys():
-                        b_map[node] = set()
-                    b_map[node].add(n)
-                    b_map[n] = {n}
+                if n.nodeType in goalTypes:
+                    branch_map.setdefault(node, set()).add(n)
+                    branch_map[n] = {n}
                     continue
                 explored.add(n)
-                recur_explore(b_map, n, explored)
-                if node not in b_map.keys():
-                    b_map[node] = set()
-                b_map[node].update(b_map[n])
-                
-        recur_explore(branch_map, start, {*ignoreNodes})
+                stack.append((n, iter(n.neighbors - explored)))
+                break
+            else:
+                stack.pop()
+                if stack:
+                    branch_map.setdefault(stack[-1][0], set()).update(branch_map.get(node, ()))
         return branch_map
 
 Deo = Device("DEO", NodeType.DEO_INPUT)
@@ -386,26 +456,6 @@ C25Split>Device("C26", NodeType.TANK)
 (((LowerLowerSplit>=Device("W12", NodeType.TANK))>Point())>=Device("W11", NodeType.TANK))>Device("V80150", NodeType.TANK)
 
 
-HOPPER_CONNECTIONS = {
-    'H41' : {
-        'OL109' : ('V40141', 'VP40100'),
-        'OL002' : ('V40241', 'VP40200'),
-        'OL054' : ('V43041', 'VP43000'),
-    },
-    'H42' : {
-        'OL056' : ('V41042', 'VP41000'),
-        'OL110' : ('V41242', 'VP41200'),
-        'OL016' : ('V41342', 'VP41300'),
-        'OL020' : ('V42142', 'VP42100'),
-    },
-    'H43' : {
-        'OL041' : ('V40443', 'VP40400'),
-        'OL050' : ('V41143', 'VP41100'),
-    },
-    'H44' : {
-        'OL013' : ('V40344', 'VP40300'),
-    },
-}
 
 
 _T = TypeVar("_T")
@@ -422,43 +472,57 @@ def group(it:Iterable[_T], length:int) -> List[List[_T]]:
                 return res
     return res
 
-def get_branch_connections(b_map:Dict[Node, Set[Node]], b:Branch):
-    if b.head not in b_map.keys() and b.tail not in b_map.keys():
-        return None
-    if b.head not in b_map.keys():
-        s = b_map[b.tail]
-    elif b.tail not in b_map.keys():
-        s = b_map[b.head]
-    else:
-        s = b_map[b.head].intersection(b_map[b.tail])
-        if len(s) == 0:
-            s = b_map[b.head].union(b_map[b.tail])
-    if len(s) == 0:
-        return None
-    return s
-
-def generate_code(g:Graph):
-    from generate import header, HMI_NAME, PLC_NAME, hoppers, valves
-    # Print header and declare variables
-    print(header)
-    script =   "macro_command main()\n"
-    script +=  "    // Declare constants\n"
-    script +=  "    bool f = false\n"
-    script +=  "    bool t = true\n"
-    script +=  "    unsigned short speed = 5\n"
-    script +=  "    \n"
-    script +=  "    // Declare macro variables\n"
-    script +=  "    bool v\n"
-    script +=  "    unsigned short speedBCD\n"
-    script +=  "    BIN2BCD(speed, speedBCD)\n"
-    script +=  "    unsigned short setSpeedBCD\n"
-    script +=  "    float floatValue\n"
-    script +=  "    \n"
-    
-    
-    
-    
-    script += f"    // Declare Valve variables\n"
+class GoalMasks:
+    """The goal nodes of an explore() map, numbered by id, and the goals of every node and branch as a bitmask."""
+    def __init__(self, b_map:Dict[Node, Set[Node]]):
+        self.goals:List[Node] = sorted({n for goals in b_map.values() for n in goals}, key=lambda n: n.id)
+        self._bits:Dict[Node, int] = {n: 1 << i for i, n in enumerate(self.goals)}
+        self._masks:Dict[Node, int] = {n: self.mask(goals) for n, goals in b_map.items()}
+        
+    def mask(self, nodes:Iterable[Node]) -> int:
+        res = 0
+        for n in nodes:
+            res |= self._bits[n]
+        return res
+    
+    def nodes(self, mask:int) -> List[Node]:
+        return [n for i, n in enumerate(self.goals) if mask >> i & 1]
+    
+    def branch(self, b:Branch) -> int:
+        """The goals both ends of b lead to, or those of either end when they share none. 0 when unknown."""
+        head = self._masks.get(b.head)
+        tail = self._masks.get(b.tail)
+        if head is None:
+            return tail or 0
+        if tail is None:
+            return head
+        return (head & tail) or (head | tail)
+    
+    def branches(self, branches:Iterable[Branch]) -> Dict[Branch, int]:
+        """The mask of every branch leading to a goal."""
+        res:Dict[Branch, int] = {}
+        for b in branches:
+            mask = self.branch(b)
+            if mask:
+                res[b] = mask
+        return res
+
+
+def generate_pipe_macro(g:Graph) -> Macro:
+    from generate import HMI_NAME, HOPPER_CONNECTIONS, PLC_NAME, hoppers, valves
+    m = Macro("PipeAnimation", "Animates the pipes from the valves and pumps feeding them.")
+    m.begin()
+    
+    speed = vushort('speed', 5)
+    speedBCD = vushort('speedBCD')
+    setSpeedBCD = vushort('setSpeedBCD')
+    floatValue = vfloat('floatValue')
+    v = vbool('v')
+    variables:Dict[str, Variable[bool]] = {}
+    def var(name:str) -> Variable[bool]:
+        if name not in variables:
+            variables[name] = vbool(name)
+        return variables[name]
     
     def nodes2valves(nodes:Iterable[Node]) -> Iterable[str]:
         tanks = filter(lambda n: n.nodeType in [NodeType.TANK, NodeType.HOPPER], nodes)
@@ -469,73 +533,73 @@ def generate_code(g:Graph):
         inputs = filter(lambda n: n.nodeType in [NodeType.HOPPER_INPUT], nodes)
         for i in inputs:
             yield HOPPER_CONNECTIONS[hopper][i.name]
-        
-    # valve_names = list(nodes2valves(g.elements()))
-    valve_names = valves
-    
-    for v in group(valve_names, 5):
-        if len(v) == 0:
-            continue
-        script += f"    bool {', '.join(v)}\n"
-    
-    script += f"    \n"
-    script += f"    \n"
     
-    script += f"    \n"
-    script += f"    \n"
-    
-    hopper_valve_names = {}
-    hopper_pump_names = {}
-    for h, inp in HOPPER_CONNECTIONS.items():
-        hopper_valve_names[h] = list([x[0] for x in inp.values()])
-        hopper_pump_names[h] = list([x[1] for x in inp.values()])
-        
-    for h in hoppers:
-        # script += f"    // Declare {h} Valves\n"
-        # script += f"    bool {', '.join(hopper_valve_names[h])}\n"
-        script += f"    // Declare {h} Pumps\n"
-        script += f"    bool {', '.join(hopper_pump_names[h])}\n"
-        script += f"    \n"
-        
-    script += f"    \n"
-    script += f"    \n"
-        
-    script += f"    // Read Valves\n"
-    for v in itertools.chain(valve_names, *hopper_valve_names.values()):
-        script += f'    GetData({v}, "{PLC_NAME}", "{v}.HMI.14", 1)\n'
-    script += f"    \n"
-    script += f"    \n"
-    
-    script += f"    // Read Main Pumps\n"
-    for p in ['MP80101', 'MP80102']:
-        script += f'    GetData({p}, "{PLC_NAME}", "{p}.HMI.14", 1)\n'
-    script += f"    \n"
-    script += f"    \n"
-    
-    script += f"    // Read Hopper Pumps\n"
-    for p in itertools.chain(*hopper_pump_names.values()):
-        script += f'    GetData({p}, "{PLC_NAME}", "{p}.HMI.14", 1)\n'
-    print(script)
-    script = ""
-    
-    script += f"    \n"
-    script += f"    \n"
-    script += f"    // Read D801\n"
-    script += f'    GetData(floatValue, "{PLC_NAME}", "D801.HLimit", 1)\n'
-    script += f'    SetData(floatValue, "{HMI_NAME}", "D801_H", 1)\n'
-    script += f'    GetData(floatValue, "{PLC_NAME}", "D801.LLimit", 1)\n'
-    script += f'    SetData(floatValue, "{HMI_NAME}", "D801_L", 1)\n'
-    script += f'    floatValue = 10\n'
-    script += f'    SetData(floatValue, "{HMI_NAME}", "D801_AL", 1)\n'
-    print(script)
-    script = ""
-    
-    
-    script += f"    \n"
-    script += f"    \n"
-    script += f"    // Write HMI Pipe values\n"
+    def key(e:EXPRESSION) -> str:
+        # The order of the terms of an and/or does not change its value
+        if isinstance(e, (AND, OR)):
+            op = ' and ' if isinstance(e, AND) else ' or '
+            return f'({op.join(sorted({key(x) for x in e._expressions}))})'
+        return str(e)
+    
+    def activate(pipes:Dict[Branch, EXPRESSION]) -> List[STATEMENT]:
+        # Pipes with the same expression evaluate it once
+        groups:Dict[str, Tuple[EXPRESSION, List[Branch]]] = {}
+        for p, e in pipes.items():
+            e = simplify(e)
+            groups.setdefault(key(e), (e, []))[1].append(p)
+        res:List[STATEMENT] = []
+        for e, ps in groups.values():
+            # A single variable is written as is
+            value = e if isinstance(e, Variable) else v
+            if value is v:
+                res.append(v.set(e))
+            res.append(setSpeedBCD.set(speedBCD * value))
+            for p in ps:
+                res += [SetData(value, HMI_NAME, p.name), SetData(setSpeedBCD, HMI_NAME, f"{p.name}Speed")]
+        return res
     
+    hopper_valve_names = {h: [x[0] for x in inp.values()] for h, inp in HOPPER_CONNECTIONS.items()}
+    hopper_pump_names = {h: [x[1] for x in inp.values()] for h, inp in HOPPER_CONNECTIONS.items()}
+    pumps = ['MP80101', 'MP80102']
+    # The valve list also holds the pumps, they are read with the pumps only
+    pump_names = {*pumps, *itertools.chain(*hopper_pump_names.values())}
+    
+    m.write(
+        CALL('BIN2BCD', speed, speedBCD),
+        EMPTY(),
+        COMMENT("Read Valves"),
+        *[GetData(var(n), PLC_NAME, f"{n}.HMI.14") for n in dict.fromkeys(itertools.chain(valves, *hopper_valve_names.values()))
+          if n not in pump_names],
+        EMPTY(),
+        COMMENT("Read Main Pumps"),
+        *[GetData(var(p), PLC_NAME, f"{p}.HMI.14") for p in pumps],
+        EMPTY(),
+        COMMENT("Read Hopper Pumps"),
+        *[GetData(var(p), PLC_NAME, f"{p}.HMI.14") for p in itertools.chain(*hopper_pump_names.values())],
+        EMPTY(),
+        COMMENT("Read D801"),
+        GetData(floatValue, PLC_NAME, "D801.HLimit"),
+        SetData(floatValue, HMI_NAME, "D801_H"),
+        GetData(floatValue, PLC_NAME, "D801.LLimit"),
+        SetData(floatValue, HMI_NAME, "D801_L"),
+        floatValue.set(10),
+        SetData(floatValue, HMI_NAME, "D801_AL"),
+        EMPTY(),
+        COMMENT("Write HMI Pipe values"),
+    )
+    
+    # The expressions of all the sections are grouped together before writing them
+    pipes:Dict[Branch, EXPRESSION] = {}
+    # Sorted for the macro to come out the same on every run
+    branches = sorted(g.branches, key=lambda b: (b.head.id, b.tail.id))
     main_b_map = g.explore(g.start, [g.start], [NodeType.PUMP], [NodeType.HOPPER, NodeType.TANK])
+    main_masks = GoalMasks(main_b_map)
+    pump = OR(*[var(p) for p in pumps])
+    pipes.update({
+        p: AND(pump, OR(*[var(valve) for valve in nodes2valves(main_masks.nodes(mask))]))
+        for p, mask in main_masks.branches(branches).items()
+        if p.head in main_b_map and p.tail in main_b_map
+    })
     
     hopper_maps = {
         H41: [H41, H41Split],
@@ -543,58 +607,33 @@ def generate_code(g:Graph):
         H43: [H43, H43Split],
         H44: [H44, H43Split],
     }
-    
-        
-    for p in g.branches:
-        if p.head not in main_b_map.keys() or p.tail not in main_b_map.keys():
-            continue
-        s = get_branch_connections(main_b_map, p)
-        if s is None:
-            continue
-        
-        pump = OR(LITERAL("MP80101"), LITERAL("MP80102"))
-            
-        script += f"    v = {AND((pump), OR(*[LITERAL(valve) for valve in nodes2valves(s)]))}\n"
-        script += f'    setSpeedBCD = speedBCD * v\n'
-        script += f'    SetData(v, "{HMI_NAME}", "{p.name}", 1)\n'
-        script += f'    SetData(setSpeedBCD, "{HMI_NAME}", "{p.name}Speed", 1)\n'
-    print(script)
-    script = ""
-    
     for hopper, ignore in hopper_maps.items():
-        script += f"    // Hopper {hopper.name}\n"
         b_map = g.explore(hopper, ignore, [], [NodeType.HOPPER_INPUT])
-        for p in g.branches:
-            if p.head not in b_map.keys() or p.tail not in b_map.keys():
-                continue
-            s = get_branch_connections(b_map, p)
-            if s is None:
-                continue
-            script += f"    v = {OR(*[AND(LITERAL(valve[0]), LITERAL(valve[1])) for valve in nodes2valves_hoppers(s, hopper.name)])}\n"
-            script += f'    setSpeedBCD = speedBCD * v\n'
-            script += f'    SetData(v, "{HMI_NAME}", "{p.name}", 1)\n'
-            script += f'    SetData(setSpeedBCD, "{HMI_NAME}", "{p.name}Speed", 1)\n'
-        script += f'    \n'
-        print(script)
-        script = ""
+        masks = GoalMasks(b_map)
+        pipes.update({
+            p: OR(*[AND(var(valve), var(pump)) for valve, pump in nodes2valves_hoppers(masks.nodes(mask), hopper.name)])
+            for p, mask in masks.branches(branches).items()
+            if p.head in b_map and p.tail in b_map
+        })
         
-    script += f'    // Other pipes\n'
-    other_pipes = {
-        g.branch_with_nodes(Deo, D801) : LITERAL('V80100'),
-        g.branch_with_nodes(D801, PrePumpSplit) : OR(LITERAL('MP80101'), LITERAL('MP80102')),
-        g.branch_with_nodes(PrePumpSplit, P80101) : LITERAL('MP80101'),
-        g.branch_with_nodes(PrePumpSplit, P80102) : LITERAL('MP80102'),
-        g.branch_with_nodes(PumpMerge, P80101) : AND(LITERAL('MP80101'), OR(*[LITERAL(f'V801{str(i).zfill(2)}') for i in [11,12,22,23,24,25,26,31,32,33,34,35,50]])),
-        g.branch_with_nodes(PumpMerge, P80102) : AND(LITERAL('MP80102'), OR(*[LITERAL(f'V801{str(i).zfill(2)}') for i in [41,42,43,44]])),
-    }
-    for pipe, expression in other_pipes.items():
-        script += f"    v = {expression}\n"
-        script += f'    setSpeedBCD = speedBCD * v\n'
-        script += f'    SetData(v, "{HMI_NAME}", "{pipe.name}", 1)\n'
-        script += f'    SetData(setSpeedBCD, "{HMI_NAME}", "{pipe.name}Speed", 1)\n'
-    
-    script += "\nend macro_command\n\n"
-    print(script)
+    # Other pipes
+    pipes.update({
+        g.branch_with_nodes(Deo, D801) : var('V80100'),
+        g.branch_with_nodes(D801, PrePumpSplit) : pump,
+        g.branch_with_nodes(PrePumpSplit, P80101) : var('MP80101'),
+        g.branch_with_nodes(PrePumpSplit, P80102) : var('MP80102'),
+        g.branch_with_nodes(PumpMerge, P80101) : AND(var('MP80101'), OR(*[var(f'V801{str(i).zfill(2)}') for i in [11,12,22,23,24,25,26,31,32,33,34,35,50]])),
+        g.branch_with_nodes(PumpMerge, P80102) : AND(var('MP80102'), OR(*[var(f'V801{str(i).zfill(2)}') for i in [41,42,43,44]])),
+    })
+    m.write(*activate(pipes))
+    m.end()
+    
+    simplify_expressions(m)
+    eliminate_common_subexpressions(m)
+    return m
+
+def generate_code(g:Graph, stream:TextIO = None):
+    generate_pipe_macro(g).bake_to(stream or sys.stdout)
 
 def gen_bit_address(start:int):
     for major in itertools.count(start):
@@ -619,13 +658,12 @@ def generate_vars(g:Graph):
         b_map = g.explore(hopper, ignore, [], [NodeType.HOPPER_INPUT])
         main_b_map.update(b_map)
     
+    masks = GoalMasks(main_b_map)
     bit_it = iter(gen_bit_address(300))
     word_it = iter(itertools.count(400))
     for p in pipes:
-        conns = get_branch_connections(main_b_map, p)
-        connections = (', '.join([n.name for n in conns]) 
-            if conns is not None and len(conns) != 0
-            else 'Other')
+        mask = masks.branch(p)
+        connections = ', '.join([n.name for n in masks.nodes(mask)]) if mask else 'Other'
         s += f"{p.name}\tLocal HMI\tLW_Bit\t{next(bit_it)}\tConnects to '{connections}'\tUndesignated\t\t\t\t\t\n"
         s += f"{p.name}Col\tLocal HMI\tLW_Bit\t{next(bit_it)}\tColor for {p.name}\tUndesignated\tConversionTag\t16-bit Signed\tFluidColor\t\t0\n"
         s += f"{p.name}Speed\tLocal HMI\tLW\t{next(word_it)}\tSpeed for {p.name}\t16-bit BCD\t\t\t\t\t\n"
@@ -0,0 +1,106 @@
+"""Registry of the macro generators and the command line that runs them.
+
+A generator is a function returning a Macro or a list of Macros (the parts of
+a partitioned macro). It is registered under a name with the generator
+decorator, once per set of arguments:
+
+    @generator('reset_tank', tanks)
+    @generator('reset_valve', valves)
+    def reset_values(vars:list) -> Macro: ...
+"""
+from __future__ import annotations
+import argparse
+import fnmatch
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Sequence, Union
+
+from api import Macro
+
+
+class Generator:
+    def __init__(self, name:str, function:Callable[..., Union[Macro, List[Macro]]], args:Sequence[Any]):
+        self.name = name
+        self.function = function
+        self.args = tuple(args)
+
+    def __call__(self) -> List[Macro]:
+        result = self.function(*self.args)
+        if isinstance(result, Macro):
+            return [result]
+        return list(result)
+
+    def __repr__(self):
+        return f'Generator({self.name})'
+
+
+GENERATORS:Dict[str, Generator] = {}
+
+def register(name:str, function:Callable[..., Union[Macro, List[Macro]]], *args:Any) -> Generator:
+    if name in GENERATORS:
+        raise ValueError(f'A generator named {name} is already registered.')
+    GENERATORS[name] = Generator(name, function, args)
+    return GENERATORS[name]
+
+def generator(name:str = None, *args:Any):
+    """Registers the decorated function, called with args, as name (its own name by default)."""
+    def decorator(function):
+        register(name or function.__name__, function, *args)
+        return function
+    return decorator
+
+def select(patterns:Sequence[str] = ('*',)) -> List[Generator]:
+    """Returns the generators matching any of the names or glob patterns, in registration order."""
+    for pattern in patterns:
+        if not any(fnmatch.fnmatchcase(name, pattern) for name in GENERATORS):
+            raise KeyError(f'No generator matches {pattern}. Known: {", ".join(GENERATORS)}')
+    return [g for name, g in GENERATORS.items() if any(fnmatch.fnmatchcase(name, p) for p in patterns)]
+
+
+def main(argv:Sequence[str] = None):
+    parser = argparse.ArgumentParser(description='Generates HMI macros.')
+    parser.add_argument('generators', nargs='*', default=['*'], help='names or glob patterns (default: all)')
+    parser.add_argument('--list', action='store_true', help='list the registered generators and exit')
+    parser.add_argument('--output', help='write each macro to <output>/<macro name>.txt instead of stdout')
+    parser.add_argument('--clipboard', action='store_true', help='also copy each macro to the clipboard, one at a time')
+    parser.add_argument('--stats', action='store_true', help='print the timing and counts of every macro to stderr')
+    parser.add_argument('--profile', action='store_true', help='like --stats, with a cProfile of every compile')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name in GENERATORS:
+            print(name)
+        return
+    try:
+        selected = select(args.generators)
+    except KeyError as e:
+        parser.error(e.args[0])
+
+    macros:List[Macro] = []
+    for g in selected:
+        start = time.perf_counter()
+        parts = g()
+        build = time.perf_counter() - start
+        if args.stats or args.profile:
+            # A partitioned macro was built by a single call, its parts share the time
+            for m in parts:
+                m.instrument(args.profile).phases['build'] = build
+        macros.extend(parts)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    for i, m in enumerate(macros):
+        if args.output:
+            m.save(os.path.join(args.output, f'{m.name}.txt'))
+            print(f'{m.name}.txt', file=sys.stderr)
+        else:
+            m.display()
+        if m.stats is not None:
+            print(m.stats, file=sys.stderr)
+        if args.clipboard:
+            try:
+                m.clipboard()
+            except ImportError:
+                parser.error('--clipboard needs the pyperclip package')
+            if i + 1 < len(macros):
+                input(f'{m.name} copied, press Enter to copy {macros[i + 1].name}')
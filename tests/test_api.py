@@ -0,0 +1,105 @@
+import os
+import sys
+from typing import List
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from api import *
+
+
+def test_failed_compile_resets_nesting():
+    f = vbool('f')
+    m = Macro('Test', 'A test macro')
+    m.begin()
+    m.write(C_IF(f))
+    m.end()
+    with pytest.raises(SyntaxError):
+        m.compile()
+    assert len(m._nest) == 0
+    assert m.indentation == 0
+
+
+def _switch(count:int, lines:int = 3) -> SWITCH:
+    index = vshort('index')
+    return SWITCH(index, {i: [COMMENT(f'case {i} line {j}') for j in range(lines)] for i in range(count)})
+
+def _macro(*statements:STATEMENT) -> Macro:
+    m = Macro('Test', 'A test macro')
+    m.begin()
+    m.write(*statements)
+    m.end()
+    return m
+
+def _run(text:str, index:int) -> List[str]:
+    """The comments a compiled case tree reaches for an index."""
+    ran = []
+    stack = []
+    active = True
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('if '):
+            taken = eval(line[len('if '):-len(' then')], {'index': index})
+            stack.append((active, taken))
+            active = active and taken
+        elif line == 'else':
+            parent, taken = stack[-1]
+            active = parent and not taken
+        elif line == 'end if':
+            active, _ = stack.pop()
+        elif line.startswith('// case') and active:
+            ran.append(line)
+    return ran
+
+def _calls(m:Macro, name:str) -> List[CALL]:
+    return [s for s in m._body() if isinstance(s, CALL) and s.funcName == name]
+
+
+def test_partition_chains_parts():
+    budget = 400
+    parts = _macro(_switch(20)).partition(budget)
+    assert len(parts) > 1
+    assert [p.name for p in parts] == [f'Test{i}' for i in range(len(parts))]
+    for i, p in enumerate(parts):
+        triggers = _calls(p, 'ASYNC_TRIG_MACRO')
+        if i + 1 < len(parts):
+            assert [t.params[0] for t in triggers] == [f'Test{i + 1}']
+        else:
+            assert triggers == []
+        body = [s for s in p._body() if not isinstance(s, EMPTY)]
+        assert len(body) > len(triggers)
+        assert sum(statement_size(s) for s in body) <= budget
+
+def test_partition_keeps_dispatch():
+    whole = _macro(_switch(11)).compile()
+    parts = [p.compile() for p in _macro(_switch(11)).partition(300)]
+    assert len(parts) > 1
+    for index in range(-1, 13):
+        assert [line for text in parts for line in _run(text, index)] == _run(whole, index)
+
+def test_partition_skips_blank_parts():
+    # begin() writes a blank line first, it must not get a part of its own
+    parts = _macro(COMMENT('a' * 50), COMMENT('b' * 50)).partition(70)
+    assert len(parts) == 2
+    assert all(len(_calls(p, 'ASYNC_TRIG_MACRO')) + 1 < len(p._body()) for p in parts[:-1])
+
+def test_partition_keeps_fitting_statement():
+    # Only one case runs, so the switch costs less than its halves together
+    def cost(s:STATEMENT) -> float:
+        return 10 if isinstance(s, SWITCH) else 0
+    assert len(_macro(_switch(8)).partition(15, cost=cost)) == 1
+
+@pytest.mark.parametrize('count', [1, 3, 5, 7])
+def test_switch_odd_case_counts(count:int):
+    text = _macro(_switch(count, lines=1)).compile()
+    for index in range(-1, count + 1):
+        assert _run(text, index) == ([f'// case {index} line 0'] if 0 <= index < count else [])
+
+def test_switch_default():
+    index = vshort('index')
+    cases = {v: COMMENT(f'case {v}') for v in (0, 1, 2, 5, 9)}
+    text = _macro(SWITCH(index, cases, [COMMENT('case default')])).compile()
+    assert text.count('// case default') == 1
+    for i in range(-1, 11):
+        assert _run(text, i) == ([f'// case {i}'] if i in cases else ['// case default'])
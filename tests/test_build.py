@@ -0,0 +1,38 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import build
+from api import COMMENT, Macro
+from registry import Generator
+
+
+PARTS = 2
+
+def parts(count:int = PARTS):
+    macros = []
+    for i in range(count):
+        m = Macro(f'Part{i}', 'A test macro')
+        m.begin()
+        m.write(COMMENT(f'part {i}'))
+        m.end()
+        macros.append(m)
+    return macros
+
+
+def test_default_change_rebuilds(tmp_path):
+    g = Generator('parts', parts, ())
+    before = build.fingerprint(g)
+    first = build.build(str(tmp_path), [g], jobs=1)
+    assert first['generators']['parts']['files'] == ['Part0.txt', 'Part1.txt']
+    assert build.build(str(tmp_path), [g], jobs=1)['generators']['parts']['cached']
+
+    parts.__defaults__ = (3,)
+    try:
+        assert build.fingerprint(g) != before
+        again = build.build(str(tmp_path), [g], jobs=1)['generators']['parts']
+        assert not again['cached']
+        assert again['files'] == ['Part0.txt', 'Part1.txt', 'Part2.txt']
+    finally:
+        parts.__defaults__ = (PARTS,)
@@ -0,0 +1,31 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from api import *
+from cost import estimate
+
+
+def _tanks(count:int) -> Macro:
+    index, a = vshort('index'), vshort('a')
+    m = Macro('Test', 'A test macro')
+    m.begin()
+    m.write(SWITCH(index, {i: [GetData(a, PLC_NAME, f'T{i}.A'), SetData(a, PLC_NAME, f'T{i}.B')] for i in range(count)}))
+    m.end()
+    return m
+
+def _switch(m:Macro) -> SWITCH:
+    return next(s for s in m.statements if isinstance(s, SWITCH))
+
+
+def test_partition_by_estimate_keeps_switch():
+    m = _tanks(14)
+    budget = estimate(_switch(m)) + estimate(ASYNC_TRIG_MACRO('Test0'))
+    assert len(m.partition(budget, cost=estimate)) == 1
+
+def test_partition_by_estimate_over_budget():
+    # Every split saves one comparison, only single cases fit
+    m = _tanks(4)
+    leaf = estimate(_switch(_tanks(1)))
+    assert len(m.partition(leaf + estimate(ASYNC_TRIG_MACRO('Test0')), cost=estimate)) == 4
@@ -0,0 +1,139 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from api import *
+from optimize import (coalesce_reads, eliminate_common_subexpressions, eliminate_dead_writes, eliminate_redundant_reads,
+                      simplify, simplify_expressions, walk_blocks)
+
+
+def _macro(*statements:STATEMENT) -> Macro:
+    m = Macro('Test', 'A test macro')
+    m.begin()
+    m.write(*statements)
+    m.end()
+    return m
+
+def _calls(m:Macro, name:str):
+    return [s for s in m.statements if isinstance(s, CALL) and s.funcName == name]
+
+def _reads(m:Macro):
+    return _calls(m, 'GetData')
+
+
+def test_coalesce_adjacent_reads():
+    a, b = vshort('a'), vshort('b')
+    m = coalesce_reads(_macro(GetData(a, PLC_NAME, 'C21.Alarms.1'), GetData(b, PLC_NAME, 'C21.Alarms.2')))
+    assert len(_reads(m)) == 1
+
+def test_coalesce_stops_at_delay():
+    a, b = vshort('a'), vshort('b')
+    m = coalesce_reads(_macro(
+        GetData(a, PLC_NAME, 'C21.Alarms.1'),
+        DELAY(100),
+        GetData(b, PLC_NAME, 'C21.Alarms.2'),
+    ))
+    assert [s.params[2] for s in _reads(m)] == ['C21.Alarms.1', 'C21.Alarms.2']
+
+def test_coalesce_stops_at_nested_trigger():
+    a, b, f = vshort('a'), vshort('b'), vbool('f')
+    m = coalesce_reads(_macro(
+        GetData(a, PLC_NAME, 'C21.Alarms.1'),
+        IF(f)(ASYNC_TRIG_MACRO('Other')),
+        GetData(b, PLC_NAME, 'C21.Alarms.2'),
+    ))
+    assert [s.params[2] for s in _reads(m)] == ['C21.Alarms.1', 'C21.Alarms.2']
+
+def test_redundant_read_dropped():
+    a = vshort('a')
+    m = eliminate_redundant_reads(_macro(GetData(a, PLC_NAME, 'C21.Level'), COMMENT('a'), GetData(a, PLC_NAME, 'C21.Level')))
+    assert len(_reads(m)) == 1
+
+def test_read_kept_after_one_branch_assigns():
+    a, f = vshort('a'), vbool('f')
+    m = eliminate_redundant_reads(_macro(
+        GetData(a, PLC_NAME, 'C21.Level'),
+        IF(f)(a.set(0)).ELSE()(COMMENT('unchanged')),
+        GetData(a, PLC_NAME, 'C21.Level'),
+    ))
+    assert len(_reads(m)) == 2
+
+def test_dead_write_dropped():
+    a = vshort('a')
+    m = eliminate_dead_writes(_macro(GetData(a, PLC_NAME, 'C21.Level'), SetData(a, PLC_NAME, 'C21.Level')))
+    assert len(_calls(m, 'SetData')) == 0
+
+def test_write_kept_when_one_path_assigns():
+    a, f = vshort('a'), vbool('f')
+    m = eliminate_dead_writes(_macro(
+        GetData(a, PLC_NAME, 'C21.Level'),
+        IF(f)(a.set(0)),
+        SetData(a, PLC_NAME, 'C21.Level'),
+    ))
+    assert len(_calls(m, 'SetData')) == 1
+
+def test_simplify_double_negation():
+    f = vbool('f')
+    assert str(simplify(NOT(NOT(f.as_literal())))) == 'f'
+    assert str(simplify(NOT(f < 3))) == 'f >= 3'
+
+def test_simplify_folds_constants():
+    f, g = vbool('f'), vbool('g')
+    assert str(simplify(AND(f, LITERAL('true')))) == 'f'
+    assert str(simplify(COMPARE(LITERAL('1'), '<', LITERAL('2')))) == 'true'
+    assert str(simplify(OR(f, NOT(f.as_literal())))) == 'true'
+    assert str(simplify(AND(f, OR(g, LITERAL('false')), f))) == '(f and g)'
+
+def test_simplify_expressions_rewrites_conditions():
+    f, g = vbool('f'), vbool('g')
+    m = simplify_expressions(_macro(IF(AND(f, NOT(NOT(g.as_literal())), LITERAL('true')))(g.set(OR(f, LITERAL('false'))))))
+    assert 'if (f and g) then' in m.compile()
+    assert 'g = f' in m.compile()
+
+def _assignments(m:Macro):
+    return [l.strip() for l in m.compile().splitlines() if l.strip().startswith('y = ')]
+
+def test_cse_reuses_holder():
+    a, b, x, y = vbool('a'), vbool('b'), vbool('x'), vbool('y')
+    m = eliminate_common_subexpressions(_macro(x.set(AND(a, b)), y.set(AND(a, b))))
+    assert _assignments(m) == ['y = x']
+
+def test_cse_operand_reassigned():
+    a, b, x, y = vbool('a'), vbool('b'), vbool('x'), vbool('y')
+    m = eliminate_common_subexpressions(_macro(x.set(AND(a, b)), a.set(False), y.set(AND(a, b))))
+    assert _assignments(m) == ['y = (a and b)']
+
+def test_cse_holder_reassigned():
+    a, b, x, y = vbool('a'), vbool('b'), vbool('x'), vbool('y')
+    m = eliminate_common_subexpressions(_macro(x.set(AND(a, b)), x.set(False), y.set(AND(a, b))))
+    assert _assignments(m) == ['y = (a and b)']
+
+def test_cse_operand_reassigned_in_nested_block():
+    # The macro language has no loop statement, the nested bodies are the if blocks
+    a, b, f, x, y = vbool('a'), vbool('b'), vbool('f'), vbool('x'), vbool('y')
+    m = eliminate_common_subexpressions(_macro(x.set(AND(a, b)), IF(f)(a.set(False)), y.set(AND(a, b))))
+    assert _assignments(m) == ['y = (a and b)']
+    m = eliminate_common_subexpressions(_macro(IF(f)(x.set(AND(a, b)), a.set(False), y.set(AND(a, b)))))
+    assert _assignments(m) == ['y = (a and b)']
+
+def _arrays(m:Macro):
+    return {str(s.params[0]).split('[')[0] for _, b in walk_blocks(m.statements) for s in b
+            if isinstance(s, CALL) and s.funcName == 'GetData' and s.params[3] > 1}
+
+def test_coalesce_shares_arrays_across_depths():
+    a, b, f, g = vshort('a'), vshort('b'), vbool('f'), vbool('g')
+    m = coalesce_reads(_macro(
+        IF(f)(GetData(a, PLC_NAME, 'C21.Alarms.1'), GetData(b, PLC_NAME, 'C21.Alarms.2')),
+        IF(g)(IF(f)(GetData(a, PLC_NAME, 'C22.Alarms.1'), GetData(b, PLC_NAME, 'C22.Alarms.2'))),
+    ))
+    assert _arrays(m) == {'reads0'}
+
+def test_coalesce_keeps_array_live_across_nested_block():
+    a, b, c, d, f = vshort('a'), vshort('b'), vshort('c'), vshort('d'), vbool('f')
+    m = coalesce_reads(_macro(
+        GetData(a, PLC_NAME, 'C21.Alarms.1'),
+        IF(f)(GetData(c, PLC_NAME, 'C22.Alarms.1'), GetData(d, PLC_NAME, 'C22.Alarms.2')),
+        GetData(b, PLC_NAME, 'C21.Alarms.2'),
+    ))
+    assert len(_arrays(m)) == 2
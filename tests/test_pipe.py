@@ -0,0 +1,137 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+
+import pipe
+from pipe import Branch, Device, Graph, NodeType, Point
+
+
+def _generate(seed:int) -> str:
+    code = 'import io, pipe; s = io.StringIO(); pipe.generate_code(pipe.Graph(pipe.PumpMerge), s); print(s.getvalue())'
+    env = {**os.environ, 'PYTHONHASHSEED': str(seed)}
+    return subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True).stdout
+
+
+def _tree():
+    """A pump feeding two tanks through a point, and a third one further down."""
+    pump = Device('Pump', NodeType.PUMP)
+    split = pump > Point()
+    t1, t2, t3 = (Device(f'T{i}', NodeType.TANK) for i in (1, 2, 3))
+    split > t1
+    split > Point() > t2 > t3
+    return pump, split, (t1, t2, t3)
+
+def _assert_indexed(g:Graph):
+    fresh = Graph(g.start)
+    assert g._nodes_by_id == fresh._nodes_by_id
+    assert set(g._branches_by_ids) == set(fresh._branches_by_ids)
+    assert g.branches == fresh.branches
+    for n in fresh._nodes_by_id.values():
+        assert g.with_name(n.name) is fresh.with_name(n.name)
+        assert g in n.graphs
+
+
+def test_same_output_every_run():
+    assert _generate(0) == _generate(1)
+
+def test_one_assignment_per_expression():
+    text = pipe.generate_pipe_macro(pipe.Graph(pipe.PumpMerge)).compile()
+    assignments = [l.strip() for l in text.splitlines() if l.strip().startswith('v = ')]
+    assert len(assignments) == len(set(assignments))
+
+def test_index_follows_attach_and_detach():
+    pump, split, (t1, t2, t3) = _tree()
+    g = Graph(pump)
+    _assert_indexed(g)
+    split.detach(t1)
+    _assert_indexed(g)
+    assert g.with_name('T1') is None
+    assert g not in t1.graphs
+    assert g.branch_with_nodes(split, t1) is None
+    # A new node brings everything attached to it
+    t4 = Device('T4', NodeType.TANK)
+    t1 > t4
+    split.attach(t1)
+    _assert_indexed(g)
+    assert g.with_name('T4') is t4
+    assert g.branch_with_nodes(t1, t4) == Branch.between(t1, t4)
+
+def test_traverse_visits_reachable_nodes_once():
+    g = pipe.Graph(pipe.PumpMerge)
+    reachable = {pipe.PumpMerge}
+    changed = True
+    while changed:
+        more = {nn for n in reachable for nn in n.neighbors} - reachable
+        reachable |= more
+        changed = len(more) > 0
+    for order in pipe.Order:
+        visited = list(g.traverse(order=order))
+        assert len(visited) == len(set(visited))
+        assert set(visited) == reachable
+    bfs = list(g.traverse())
+    # Breadth first: the neighbors of the start come right after it
+    assert bfs[0] == pipe.PumpMerge
+    assert set(bfs[1:1 + len(pipe.PumpMerge.neighbors)]) == pipe.PumpMerge.neighbors
+
+def test_explore_cache_follows_changes():
+    pump, split, (t1, t2, t3) = _tree()
+    g = Graph(pump)
+    tanks = [NodeType.TANK]
+    assert g.explore(pump, [], [], tanks)[pump] == {t1, t2}
+    split.detach(t1)
+    assert g.explore(pump, [], [], tanks)[pump] == {t2}
+    split.attach(t1)
+    assert g.explore(pump, [], [], tanks)[pump] == {t1, t2}
+    # Cached results are copies, changing one does not change the next
+    g.explore(pump, [], [], tanks).pop(pump)
+    assert pump in g.explore(pump, [], [], tanks)
+
+def _goals_through(g:Graph, start, goal_types) -> dict:
+    """Brute force on a tree: a node leads to the goals whose path from start goes through it."""
+    parents = {start: None}
+    for n in g.traverse(start):
+        for nn in n.neighbors:
+            if nn not in parents and n.nodeType not in goal_types:
+                parents[nn] = n
+    res = {}
+    for goal in (n for n in parents if n.nodeType in goal_types):
+        n = goal
+        while n is not None:
+            res.setdefault(n, set()).add(goal)
+            n = parents[n]
+    return res
+
+def _branch_goals(goals:dict, b:Branch) -> set:
+    # The goals both ends lead to, or those of either end when they share none
+    head, tail = goals.get(b.head), goals.get(b.tail)
+    if head is None or tail is None:
+        return head or tail or set()
+    return (head & tail) or (head | tail)
+
+def test_goal_masks_match_reachability():
+    pump, split, (t1, t2, t3) = _tree()
+    g = Graph(pump)
+    b_map = g.explore(pump, [], [], [NodeType.TANK])
+    expected = _goals_through(g, pump, [NodeType.TANK])
+    assert {n: goals for n, goals in b_map.items() if goals} == expected
+    masks = pipe.GoalMasks(b_map)
+    for n, goals in expected.items():
+        assert set(masks.nodes(masks.mask(goals))) == goals
+    for b in g.branches:
+        assert set(masks.nodes(masks.branch(b))) == _branch_goals(expected, b)
+
+def test_goal_masks_match_pipe_graph():
+    g = pipe.Graph(pipe.PumpMerge)
+    b_map = g.explore(g.start, [g.start], [NodeType.PUMP], [NodeType.HOPPER, NodeType.TANK])
+    masks = pipe.GoalMasks(b_map)
+    for b in g.branches:
+        assert set(masks.nodes(masks.branch(b))) == _branch_goals(b_map, b)
+
+def test_each_tag_read_once():
+    m = pipe.generate_pipe_macro(pipe.Graph(pipe.PumpMerge))
+    tags = [s.params[2] for s in m.statements if isinstance(s, pipe.CALL) and s.funcName == 'GetData']
+    assert len(tags) == len(set(tags))